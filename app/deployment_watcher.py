@@ -1,24 +1,44 @@
 import json
+from time import sleep
+from threading import Thread
+from collections import OrderedDict
 from src.utils.pyredis import redis
-from src import dbi
+from src import db, dbi
 from src.models import Deployment
-from src.helpers.deployment_helper import current_stage, format_stages
+from src.helpers.deployment_helper import current_stage, format_stages, format_stage_log, read_stage_logs, \
+  stage_streams
 from src.helpers.definitions import deploy_update_queue
 from src.utils.pubsub import publish
+from src.utils.job_queue import job_queue
+from src.utils.log_archive import STREAM_TTL
+from src.utils.log_hub import next_id, parse_id
+from src.utils.update_streams import ShardConsumer
+from src.services.deployment_services.archive_deployment_logs import ArchiveDeploymentLogs
 
+# How long (s) to let updates accumulate after the first one of a window arrives
+COALESCE_WINDOW = 0.25
 
-def handle_update(item):
-  item = json.loads(item[1]) or {}
+# Max number of updates taken per window
+MAX_WINDOW_ITEMS = 5000
 
-  if not item:
-    return
+# Max number of deployments whose published state is tracked (least recently updated ones are forgotten first)
+MAX_TRACKED_DEPLOYMENTS = 5000
 
-  deployment_uid = item.get('deployment_uid')
-  stage = item.get('stage')
+# deployment_uid --> {'cursors': {stream_key: last published entry id}, 'stages': {stage: published flags}}
+published = OrderedDict()
 
-  if not deployment_uid or not stage:
-    return
 
+def parse_update(update):
+  """
+  Get the deployment_uid a deploy update is for (None if it's not a valid update).
+  """
+  if not isinstance(update, dict) or not update.get('deployment_uid') or not update.get('stage'):
+    return None
+
+  return update['deployment_uid']
+
+
+def handle_update(deployment_uid):
   # Get deployment for uid
   deployment = dbi.find_one(Deployment, {'uid': deployment_uid})
 
@@ -30,24 +50,176 @@ def handle_update(item):
     'intent': deployment.intent,
     'failed': deployment.failed,
     'succeeded': deployment.succeeded(),
-    'current_stage': current_stage(deployment),
-    'stages': format_stages(deployment)
+    'current_stage': current_stage(deployment)
   }
 
+  state = published.pop(deployment_uid, None)
+
+  if state is None:
+    # First update seen for this deployment (or it was forgotten) --> publish a full snapshot, with each
+    # stream's cursor at the last entry the snapshot read (anything after it goes out with the next delta)
+    state = {'cursors': {}}
+    stages = format_stages(deployment, stage_logs=read_stage_logs(deployment, cursors=state['cursors']))
+    payload['delta'] = False
+    payload['stages'] = stages
+  else:
+    stages, payload['stages'] = stage_deltas(deployment, state)
+    payload['delta'] = True
+
+  state['stages'] = {stage: stage_flags(content) for stage, content in stages.items()}
+  track(deployment_uid, state)
+
   publish(deployment_uid, payload)
 
+  # Archive the logs of finished deployments so they can expire from redis
+  if deployment.failed or deployment.succeeded():
+    schedule_log_archival(deployment)
+
+
+def stream_keys(deployment):
+  return [deployment.train_deploy_log(), deployment.train_log(), deployment.api_deploy_log()]
+
+
+def stage_flags(content):
+  return {k: v for k, v in content.items() if k != 'logs'}
+
+
+def stage_deltas(deployment, state):
+  """
+  Get what changed for each stage since the deployment's last published update.
+
+  Clients merge a stage's delta into what they have: changed flags replace old ones, 'new_logs' are
+  appended to the stage's logs, and 'logs' (sent when a stage is first shown) replace them.
+
+  :return: tuple --> (current stage contents without logs, dict of stage --> delta for changed stages)
+  """
+  cursors = state['cursors']
+  stages = format_stages(deployment, with_logs=False)
+  new_logs = read_new_logs(deployment, cursors)
+
+  # Stages being shown for the first time need their full logs (and only they are read in full)
+  newly_shown = [stage for stage, content in stages.items()
+                 if content.get('show') and 'logs' in content and not state['stages'].get(stage, {}).get('show')]
+
+  shown_logs = read_stage_logs(deployment, stages=newly_shown) if newly_shown else {}
+  stage_stream = {stage: key for key, key_stages in stage_streams(deployment).items() for stage in key_stages}
+
+  deltas = {}
+
+  for stage, content in stages.items():
+    prev_flags = state['stages'].get(stage, {})
+    delta = {k: v for k, v in stage_flags(content).items() if prev_flags.get(k) != v}
+
+    if stage in newly_shown:
+      # Entries past the stream's cursor go out as new_logs with the next delta instead
+      cursor = parse_id(cursors.get(stage_stream[stage], '0-0'))
+
+      delta['logs'] = [format_stage_log(stage, data) for entry_id, data in shown_logs.get(stage, [])
+                       if parse_id(entry_id) <= cursor]
+    elif content.get('show') and new_logs.get(stage):
+      delta['new_logs'] = new_logs[stage]
+
+    if delta:
+      deltas[stage] = delta
+
+  return stages, deltas
+
+
+def read_new_logs(deployment, cursors):
+  """
+  Read (and format) the log entries added to a deployment's streams since the given cursors, advancing them.
+
+  :return: dict of stage --> list of new formatted log lines
+  """
+  keys = stream_keys(deployment)
+
+  pipe = redis.pipeline()
+
+  for key in keys:
+    pipe.execute_command('XRANGE', key, next_id(cursors.get(key, '0-0')), '+')
+
+  new_logs = {}
+  train_log = deployment.train_log()
+
+  for key, entries in zip(keys, pipe.execute()):
+    if not entries:
+      continue
+
+    cursors[key] = entries[-1][0]
+
+    for entry_id, data in entries:
+      # Training logs don't carry a stage -- they all belong to training
+      stage = deployment.statuses.TRAINING if key == train_log else data.get('stage')
+
+      if stage:
+        new_logs.setdefault(stage, []).append(format_stage_log(stage, data))
+
+  return new_logs
+
+
+def track(deployment_uid, state):
+  published[deployment_uid] = state
+
+  while len(published) > MAX_TRACKED_DEPLOYMENTS:
+    published.popitem(last=False)
+
+
+def schedule_log_archival(deployment):
+  # Only schedule once per finish (a failed API deploy can be retried, finishing the deployment again)
+  scheduled_key = 'log-archive-scheduled:{}:{}:{}:{}'.format(
+    deployment.uid, deployment.status, deployment.failed, deployment.intent_updated_at)
+
+  if not redis.set(scheduled_key, 1, nx=True, ex=STREAM_TTL):
+    return
+
+  archiver = ArchiveDeploymentLogs(deployment_uid=deployment.uid)
+  job_queue.add(archiver.perform, meta={'deployment': deployment.uid})
+
 
 def watch():
+  consumer = ShardConsumer(deploy_update_queue, shard_key_field='deployment_uid')
+
+  if consumer.owns_legacy_queue():
+    forwarder = Thread(target=consumer.forward_legacy_queue_forever)
+    forwarder.daemon = True
+    forwarder.start()
+
   while True:
-    item = redis.blpop(deploy_update_queue, timeout=30)
+    entries = consumer.read(block=30000)
 
-    if not item:
+    if not entries:
       continue
 
-    try:
-      handle_update(item)
-    except BaseException as e:
-      print(e.__dict__)
+    # Let the rest of a burst of updates land, then take them all at once
+    sleep(COALESCE_WINDOW)
+
+    while len(entries) < MAX_WINDOW_ITEMS:
+      batch = consumer.read()
+
+      if not batch:
+        break
+
+      entries.extend(batch)
+
+    # Publish once per deployment per window (each update publishes everything new since the last one)
+    deployment_uids = OrderedDict()
+
+    for stream, entry_id, update in entries:
+      deployment_uid = parse_update(update)
+
+      if deployment_uid:
+        deployment_uids[deployment_uid] = True
+
+    for deployment_uid in deployment_uids:
+      try:
+        handle_update(deployment_uid)
+      except BaseException as e:
+        print(e.__dict__)
+
+    consumer.ack(entries)
+
+    # Start each window with a fresh session so deployments are re-read rather than served from its identity map
+    db.session.remove()
 
 
 if __name__ == '__main__':
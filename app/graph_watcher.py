@@ -1,75 +1,74 @@
-import json
-from sqlalchemy.orm import joinedload
-from src import dbi, db
-from src.models import Graph, GraphDataGroup, GraphDataPoint, Deployment
+from threading import Thread
+from src import db
 from src.helpers.definitions import graph_update_queue
-from src.helpers.graph_helper import formatted_graphs
-from src.utils.pubsub import publish
-from src.utils.pyredis import redis
+from src.helpers.graph_helper import publish_new_points
+from src.utils.update_streams import ShardConsumer
+from src.services.graph_services.add_graph_data_points import AddGraphDataPoints
 
+# Max number of queued data points taken per batch
+MAX_BATCH_ITEMS = 5000
 
-def handle_new_data_point(item):
-  item = json.loads(item[1]) or {}
 
-  if not item:
-    return
+def handle_new_data_points(items):
+  """
+  Insert a batch of queued data points (in bulk), then publish what was added to each graph.
+  """
+  svc = AddGraphDataPoints(points=items)
+  svc.perform()
 
-  graph_uid = item.get('graph_uid')
-  series = item.get('series') or 'default'
-  color = item.get('color')
-  x = item.get('x')
-  y = item.get('y')
+  publish_new_points(svc.graphs, svc.new_points)
 
-  if not graph_uid or x is None or y is None:
-    return
 
-  graph = dbi.find_one(Graph, {'uid': graph_uid})
+def handle_entries(consumer, entries):
+  """
+  Handle a batch of queued entries, acking them once they're persisted.
 
-  if not graph:
-    return
+  If the batch fails, each half of it is retried on its own (down to single entries), so one bad point doesn't
+  take the rest of its batch down with it. Entries that still fail are left pending, for reclaim to retry.
+  """
+  try:
+    handle_new_data_points([item for stream, entry_id, item in entries])
+  except BaseException as e:
+    print(e.__dict__)
+    db.session.rollback()
 
-  group, is_new = dbi.upsert(GraphDataGroup, {
-    'graph': graph,
-    'name': series,
-  })
+    if len(entries) > 1:
+      middle = len(entries) // 2
+      handle_entries(consumer, entries[:middle])
+      handle_entries(consumer, entries[middle:])
 
-  if color:
-    dbi.update(group, {'color': color})
+    return
 
-  dbi.create(GraphDataPoint, {
-    'graph_data_group': group,
-    'data': {
-      'x': x,
-      'y': y
-    }
-  })
+  consumer.ack(entries)
 
-  deployment_id = graph.deployment_id
 
-  deployment = db.session.query(Deployment).options(
-    joinedload(Deployment.graphs)
-      .subqueryload(Graph.graph_data_groups)
-      .subqueryload(GraphDataGroup.graph_data_points)).filter(Deployment.id == deployment_id).first()
+def watch():
+  consumer = ShardConsumer(graph_update_queue, shard_key_field='graph_uid')
 
-  if not deployment:
-    return
+  if consumer.owns_legacy_queue():
+    forwarder = Thread(target=consumer.forward_legacy_queue_forever)
+    forwarder.daemon = True
+    forwarder.start()
 
-  payload = {'graphs': formatted_graphs(deployment.graphs)}
+  while True:
+    entries = consumer.read(block=30000)
 
-  publish(graph_uid, payload)
+    if not entries:
+      continue
 
+    # Take whatever else is already queued up, so it's all inserted (and published) together
+    while len(entries) < MAX_BATCH_ITEMS:
+      batch = consumer.read()
 
-def watch():
-  while True:
-    item = redis.blpop(graph_update_queue, timeout=30)
+      if not batch:
+        break
 
-    if not item:
-      continue
+      entries.extend(batch)
+
+    handle_entries(consumer, entries)
 
-    try:
-      handle_new_data_point(item)
-    except BaseException as e:
-      print(e.__dict__)
+    # Start each batch with a fresh session so graphs are re-read rather than served from its identity map
+    db.session.remove()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+"""
+Async server for long-lived deployment log streams.
+
+Log streams can stay open for as long as a model trains (hours), which would pin a sync uwsgi
+worker for the whole time. When LOG_STREAM_URL is configured, the API hands these streams off
+here instead, redirecting clients to /logs?token=<single-use handoff token>.
+
+Each stream is a greenlet rather than a worker, and every stream in this process tails redis
+through the same log hub, so one process can hold thousands of concurrent streams.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import json
+from urlparse import parse_qs
+from gevent.pywsgi import WSGIServer
+from gevent.socket import wait_read, wait_write
+from psycopg2 import extensions, OperationalError
+from src import db, dbi
+from src.models import Deployment
+from src.utils import log_streamer
+from src.api_responses.errors import UNAUTHORIZED, DEPLOYMENT_NOT_FOUND
+from src.helpers.definitions import core_header_name
+
+STREAM_PATH = '/logs'
+
+STATS_PATH = '/stats'
+
+NOT_FOUND = {'ok': False, 'code': 404, 'error': 'not_found'}, 404
+
+STATUS_LINES = {
+  200: '200 OK',
+  401: '401 Unauthorized',
+  404: '404 Not Found'
+}
+
+
+def gevent_wait_callback(conn, timeout=None):
+  # Wait on Postgres sockets cooperatively so DB queries don't block every other stream
+  while True:
+    state = conn.poll()
+
+    if state == extensions.POLL_OK:
+      break
+    elif state == extensions.POLL_READ:
+      wait_read(conn.fileno(), timeout=timeout)
+    elif state == extensions.POLL_WRITE:
+      wait_write(conn.fileno(), timeout=timeout)
+    else:
+      raise OperationalError('Bad result from poll: {}'.format(state))
+
+
+extensions.set_wait_callback(gevent_wait_callback)
+
+
+def respond_with(response, start_response):
+  body, status = response
+  start_response(STATUS_LINES[status], [('Content-Type', 'application/json')])
+  return [json.dumps(body)]
+
+
+def stream(logs):
+  try:
+    for chunk in logs:
+      yield chunk
+  finally:
+    # Stop tailing as soon as the client goes away
+    logs.close()
+    db.session.remove()
+
+
+def stats(environ, start_response):
+  # Tail latencies of the streams held by this process (same auth as the API's /stats)
+  token = environ.get('HTTP_{}'.format(core_header_name.upper().replace('-', '_')))
+
+  if token != os.environ.get('CORE_API_TOKEN'):
+    return respond_with(UNAUTHORIZED, start_response)
+
+  return respond_with(({'log_tails': log_streamer.tail_metrics()}, 200), start_response)
+
+
+def app(environ, start_response):
+  path = environ.get('PATH_INFO', '').rstrip('/')
+
+  if path == STATS_PATH:
+    return stats(environ, start_response)
+
+  if path != STREAM_PATH:
+    return respond_with(NOT_FOUND, start_response)
+
+  token = parse_qs(environ.get('QUERY_STRING', '')).get('token', [None])[0]
+  handoff = log_streamer.redeem_handoff_token(token) if token else None
+
+  if not handoff:
+    return respond_with(UNAUTHORIZED, start_response)
+
+  try:
+    deployment = dbi.find_one(Deployment, {'uid': handoff['deployment_uid']})
+  finally:
+    # Don't hold a DB connection for the life of the stream. The (now detached) deployment is only
+    # read for its uid and intent -- failing it re-queries it in a short-lived session.
+    db.session.remove()
+
+  if not deployment:
+    return respond_with(DEPLOYMENT_NOT_FOUND, start_response)
+
+  logs = log_streamer.open_stream(deployment,
+                                  handoff['kind'],
+                                  stream_key=handoff.get('stream_key'),
+                                  resume_token=handoff.get('resume_token'),
+                                  with_resume_tokens=handoff.get('with_resume_tokens', False))
+
+  start_response(STATUS_LINES[200], [
+    ('Content-Type', 'text/html; charset=utf-8'),
+    ('Cache-Control', 'no-cache'),
+    ('X-Accel-Buffering', 'no')
+  ])
+
+  return stream(logs)
+
+
+if __name__ == '__main__':
+  port = int(os.environ.get('PORT', 80))
+  WSGIServer(('0.0.0.0', port), app).serve_forever()
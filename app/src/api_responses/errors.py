@@ -34,6 +34,7 @@ DATASET_CREATION_FAILED = {'ok': False, 'code': 1501, 'error': 'dataset_creation
 NO_FILE_PROVIDED = {'ok': False, 'code': 1502, 'error': 'no_file_provided'}, 500
 DATASET_NOT_FOUND = {'ok': False, 'code': 1503, 'error': 'dataset_not_found'}, 404
 DATASET_DELETION_FAILED = {'ok': False, 'code': 1504, 'error': 'dataset_deletion_failed'}, 500
+DATASET_APPEND_FAILED = {'ok': False, 'code': 1505, 'error': 'dataset_append_failed'}, 500
 
 # Bucket Errors
 BUCKET_NOT_FOUND = {'ok': False, 'code': 1600, 'error': 'bucket_not_found'}, 404
@@ -63,4 +64,7 @@ DEPLOYMENT_NOT_FOUND = {'ok': False, 'code': 2100, 'error': 'deployment_not_foun
 # Env Errors
 ERROR_UPSERTING_ENVS = {'ok': False, 'code': 2200, 'error': 'error_upserting_envs'}, 500
 ENV_NOT_FOUND = {'ok': False, 'code': 2201, 'error': 'env_not_found'}, 404
-ERROR_DELETING_ENV = {'ok': False, 'code': 2202, 'error': 'error_deleting_env'}, 500
\ No newline at end of file
+ERROR_DELETING_ENV = {'ok': False, 'code': 2202, 'error': 'error_deleting_env'}, 500
+
+# Graph Errors
+ERROR_ADDING_GRAPH_DATA_POINTS = {'ok': False, 'code': 2300, 'error': 'error_adding_graph_data_points'}, 500
\ No newline at end of file
@@ -13,6 +13,7 @@ API_DEPLOYMENT_SUCCESS = {'ok': True, 'message': 'API Deployment Successfully St
 DATASET_CREATION_SUCCESS = {'ok': True, 'message': 'Dataset Successfully Created'}, 201
 DATASET_SUCCESSFULLY_UPDATED = {'ok': True, 'message': 'Dataset Successfully Updated'}, 200
 DATASET_SUCCESSFULLY_DELETED = {'ok': True, 'message': 'Dataset Successfully Deleted'}, 200
+DATASET_RECORDS_SUCCESSFULLY_APPENDED = {'ok': True, 'message': 'Dataset Records Successfully Appended'}, 201
 
 # User
 UPDATE_USER_PW_SUCCESS = {'ok': True, 'message': 'Successfully Updated User Password'}, 200
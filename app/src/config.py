@@ -19,6 +19,7 @@ class ProdConfig(Config):
     self.SOCKET_URL = os.environ.get('SOCKET_URL') or 'https://api.{}'.format(self.DOMAIN)
     self.DASH_URL = os.environ.get('DASH_URL') or 'https://app.{}'.format(self.DOMAIN)
     self.MARKETING_URL = os.environ.get('MARKETING_URL') or 'https://www.{}'.format(self.DOMAIN)
+    self.LOG_STREAM_URL = os.environ.get('LOG_STREAM_URL')
 
 
 class StagingConfig(Config):
@@ -32,6 +33,7 @@ class StagingConfig(Config):
     self.SOCKET_URL = os.environ.get('SOCKET_URL') or 'https://api.{}'.format(self.DOMAIN)
     self.DASH_URL = os.environ.get('DASH_URL') or 'https://app.{}'.format(self.DOMAIN)
     self.MARKETING_URL = os.environ.get('MARKETING_URL') or 'https://www.{}'.format(self.DOMAIN)
+    self.LOG_STREAM_URL = os.environ.get('LOG_STREAM_URL')
 
 
 class DevConfig(Config):
@@ -44,6 +46,7 @@ class DevConfig(Config):
     self.SOCKET_URL = os.environ.get('SOCKET_URL') or 'https://api.{}'.format(self.DOMAIN)
     self.DASH_URL = os.environ.get('DASH_URL') or 'https://app.{}'.format(self.DOMAIN)
     self.MARKETING_URL = os.environ.get('MARKETING_URL') or 'https://www.{}'.format(self.DOMAIN)
+    self.LOG_STREAM_URL = os.environ.get('LOG_STREAM_URL')
 
 
 class TestConfig(Config):
@@ -55,6 +58,7 @@ class TestConfig(Config):
     self.DASH_URL = os.environ.get('DASH_URL') or 'http://localhost'
     self.CORE_URL = os.environ.get('CORE_URL') or 'http://localhost/api'
     self.SOCKET_URL = os.environ.get('SOCKET_URL') or 'http://localhost'
+    self.LOG_STREAM_URL = os.environ.get('LOG_STREAM_URL')
 
 
 def get_config():
@@ -2,6 +2,7 @@ import os
 from time import sleep
 from abstract_deploy import AbstractDeploy
 from src import dbi, logger
+from src.utils.logger import buffered
 from src.utils import clusters
 from src.services.prediction_services.publicize_prediction import PublicizePrediction
 from src.services.cluster_services.export_cluster import ExportCluster
@@ -17,6 +18,7 @@ class ApiDeploy(AbstractDeploy):
     super(ApiDeploy, self).__init__(deployment_uid)
     self.stage = None
 
+  @buffered
   def deploy(self):
     self.set_db_reliant_attrs()
     self.log_stream_key = self.deployment.api_deploy_log()
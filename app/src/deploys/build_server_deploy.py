@@ -8,6 +8,7 @@ from src.helpers import ms_since_epoch
 from kubernetes import watch
 from src.utils.aws import create_s3_bucket
 from src import dbi, logger
+from src.utils.logger import buffered
 from src.utils.job_queue import job_queue
 from src.services.cluster_services.create_cluster import CreateCluster
 
@@ -19,6 +20,7 @@ class BuildServerDeploy(AbstractDeploy):
     self.build_for = build_for
     self.update_prediction_model = update_prediction_model
 
+  @buffered
   def deploy(self):
     self.set_db_reliant_attrs()
     self.log_stream_key = self.get_log_stream_key()
@@ -1,6 +1,7 @@
 import os
 from abstract_deploy import AbstractDeploy
 from src import logger, dbi
+from src.utils.logger import buffered
 from src.models import TrainJob
 from src.utils import clusters
 from src.config import config
@@ -14,6 +15,7 @@ class TrainDeploy(AbstractDeploy):
     self.update_prediction_model = update_prediction_model
     self.stage = None
 
+  @buffered
   def deploy(self):
     self.set_db_reliant_attrs()
     self.log_stream_key = self.deployment.train_deploy_log()
@@ -0,0 +1,20 @@
+from src.utils import compression, json_stream
+
+
+def read_records(fileobj, content_encoding=None):
+  """
+  Lazily decompress (if needed) and parse an uploaded JSON file, one array element at a time.
+
+  The upload's start is checked right away (so a file that isn't a JSON array fails here), while errors
+  further into it are raised as the records are iterated over.
+
+  :param fileobj:          (required) file-like object of the upload
+  :param content_encoding: (optional) upload's Content-Encoding (sniffed from its first bytes if not given)
+
+  :return: generator of records
+  """
+  try:
+    fileobj = compression.open_stream(fileobj, content_encoding=content_encoding)
+    return json_stream.iter_array(fileobj)
+  except ValueError as e:
+    raise BaseException(str(e))
\ No newline at end of file
@@ -0,0 +1,2 @@
+JSON = 'json'
+TYPED = 'typed'
\ No newline at end of file
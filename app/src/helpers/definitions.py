@@ -9,5 +9,6 @@ core_header_name = 'Core-Api-Token'
 train_cluster_header_name = 'TensorCI-Train-Secret'
 cookie_name = 'tensorci-user'
 tci_keep_alive = '<tci-keep-alive>'
+tci_resume_token = '<tci-resume-token>'
 deploy_update_queue = 'deploy-update-queue'
 graph_update_queue = 'graph-update-queue'
\ No newline at end of file
@@ -1,24 +1,78 @@
 import os
-from src.utils import log_formatter
-from src.utils.pyredis import redis
+from collections import defaultdict
+from src.utils import log_formatter, log_archive, log_stage_index
 from src.models import Deployment
 
 
-def format_stages(deployment):
+def format_stages(deployment, with_logs=True, stage_logs=None):
   statuses = deployment.statuses
 
+  # Without logs, this just reports each stage's flags (show, succeeded, failed)
+  if stage_logs is None:
+    stage_logs = read_stage_logs(deployment) if with_logs else defaultdict(list)
+
   return {
-    statuses.BUILDING_FOR_TRAIN: format_train_building_stage(deployment),
-    statuses.TRAINING_SCHEDULED: format_train_deploying_stage(deployment),
-    statuses.TRAINING: format_training_stage(deployment),
+    statuses.BUILDING_FOR_TRAIN: format_train_building_stage(deployment, stage_logs),
+    statuses.TRAINING_SCHEDULED: format_train_deploying_stage(deployment, stage_logs),
+    statuses.TRAINING: format_training_stage(deployment, stage_logs),
     statuses.DONE_TRAINING: format_trained_stage(deployment),
-    statuses.BUILDING_FOR_API: format_api_building_stage(deployment),
-    statuses.PREDICTING_SCHEDULED: format_api_deploying_stage(deployment),
+    statuses.BUILDING_FOR_API: format_api_building_stage(deployment, stage_logs),
+    statuses.PREDICTING_SCHEDULED: format_api_deploying_stage(deployment, stage_logs),
     statuses.PREDICTING: format_predicting_stage(deployment)
   }
 
 
-def format_train_building_stage(deployment):
+def stage_streams(deployment):
+  """
+  Get which stages' logs each of a deployment's log streams holds.
+
+  :return: dict of stream_key --> list of stages
+  """
+  statuses = deployment.statuses
+
+  return {
+    deployment.train_deploy_log(): [statuses.BUILDING_FOR_TRAIN, statuses.TRAINING_SCHEDULED],
+    deployment.train_log(): [statuses.TRAINING],
+    deployment.api_deploy_log(): [statuses.BUILDING_FOR_API, statuses.PREDICTING_SCHEDULED]
+  }
+
+
+def read_stage_logs(deployment, stages=None, cursors=None):
+  """
+  Read the logs of every stage being shown (or just the given ones), with one targeted range read per deploy stage.
+
+  :param deployment: (required) Deployment to read the logs of
+  :param stages:     (optional) stages to read the logs of (every shown stage if None)
+  :param cursors:    (optional) dict to fill with the id of the last entry each stream was read up to
+
+  :return: dict of stage --> list of (entry_id, data) tuples
+  """
+  statuses = deployment.statuses
+  train_log = deployment.train_log()
+
+  # Only bother reading the logs of stages that will be shown
+  stream_stages = {key: [stage for stage in key_stages if (stages is None or stage in stages) and
+                         (stage == statuses.BUILDING_FOR_TRAIN or should_show_stage(deployment, stage))]
+                   for key, key_stages in stage_streams(deployment).items()}
+
+  stream_stages = {key: key_stages for key, key_stages in stream_stages.items() if key_stages}
+
+  stage_logs = defaultdict(list)
+
+  # Training logs don't carry a stage -- the whole stream belongs to training
+  if stream_stages.pop(train_log, None):
+    stage_logs[statuses.TRAINING] = log_archive.read_stream(train_log)
+
+    if cursors is not None and stage_logs[statuses.TRAINING]:
+      cursors[train_log] = stage_logs[statuses.TRAINING][-1][0]
+
+  if stream_stages:
+    stage_logs.update(log_stage_index.read_stage_logs(stream_stages, cursors=cursors))
+
+  return stage_logs
+
+
+def format_train_building_stage(deployment, stage_logs):
   stage = deployment.statuses.BUILDING_FOR_TRAIN
 
   return {
@@ -26,13 +80,11 @@ def format_train_building_stage(deployment):
     'show': True,
     'succeeded': stage_succeeded(deployment, stage),
     'failed': stage_failed(deployment, stage),
-    'logs': [log_formatter.deploy_log(data).rstrip()
-             for ts, data in redis.xrange(deployment.train_deploy_log())
-             if data.get('stage') == stage]
+    'logs': [format_stage_log(stage, data) for ts, data in stage_logs[stage]]
   }
 
 
-def format_train_deploying_stage(deployment):
+def format_train_deploying_stage(deployment, stage_logs):
   stage = deployment.statuses.TRAINING_SCHEDULED
 
   content = {
@@ -45,14 +97,12 @@ def format_train_deploying_stage(deployment):
 
   if should_show_stage(deployment, stage):
     content['show'] = True
-    content['logs'] = [log_formatter.deploy_log(data).rstrip()
-                       for ts, data in redis.xrange(deployment.train_deploy_log())
-                       if data.get('stage') == stage]
+    content['logs'] = [format_stage_log(stage, data) for ts, data in stage_logs[stage]]
 
   return content
 
 
-def format_training_stage(deployment):
+def format_training_stage(deployment, stage_logs):
   stage = deployment.statuses.TRAINING
 
   content = {
@@ -65,8 +115,7 @@ def format_training_stage(deployment):
 
   if should_show_stage(deployment, stage):
     content['show'] = True
-    content['logs'] = [log_formatter.training_log(data, with_ts=False).rstrip()
-                       for ts, data in redis.xrange(deployment.train_log())]
+    content['logs'] = [format_stage_log(stage, data) for ts, data in stage_logs[stage]]
 
   return content
 
@@ -78,7 +127,7 @@ def format_trained_stage(deployment):
   }
 
 
-def format_api_building_stage(deployment):
+def format_api_building_stage(deployment, stage_logs):
   stage = deployment.statuses.BUILDING_FOR_API
 
   content = {
@@ -91,14 +140,12 @@ def format_api_building_stage(deployment):
 
   if should_show_stage(deployment, stage):
     content['show'] = True
-    content['logs'] = [log_formatter.deploy_log(data).rstrip()
-                       for ts, data in redis.xrange(deployment.api_deploy_log())
-                       if data.get('stage') == stage]
+    content['logs'] = [format_stage_log(stage, data) for ts, data in stage_logs[stage]]
 
   return content
 
 
-def format_api_deploying_stage(deployment):
+def format_api_deploying_stage(deployment, stage_logs):
   stage = deployment.statuses.PREDICTING_SCHEDULED
 
   content = {
@@ -111,9 +158,7 @@ def format_api_deploying_stage(deployment):
 
   if should_show_stage(deployment, stage):
     content['show'] = True
-    content['logs'] = [log_formatter.deploy_log(data).rstrip()
-                       for ts, data in redis.xrange(deployment.api_deploy_log())
-                       if data.get('stage') == stage]
+    content['logs'] = [format_stage_log(stage, data) for ts, data in stage_logs[stage]]
   return content
 
 
@@ -124,6 +169,13 @@ def format_predicting_stage(deployment):
   }
 
 
+def format_stage_log(stage, data):
+  if stage == Deployment.statuses.TRAINING:
+    return log_formatter.training_log(data, with_ts=False).rstrip()
+
+  return log_formatter.deploy_log(data).rstrip()
+
+
 def current_stage(deployment):
   statuses = deployment.statuses
 
@@ -1,10 +1,27 @@
-from operator import attrgetter
+from sqlalchemy.orm import joinedload
+from src import db
+from src.models import Deployment, Graph, GraphDataGroup
+from src.utils.pubsub import publish
+from src.utils.pyredis import redis
+from src.utils import downsample, graph_series
 
+# How often (s) a deployment's full graphs are published (for clients that missed earlier deltas)
+SNAPSHOT_INTERVAL = 30
 
-def formatted_graphs(graphs):
+
+def formatted_graphs(graphs, max_points=None, downsample_method=downsample.LTTB):
+  """
+  Format graphs with their series' data points.
+
+  Graphs and groups are expected newest first and chunks by x_min (as their relationships load them), so
+  series come out sorted by x without any sorting here.
+
+  :param max_points:        (optional) max number of points per series (downsampled past that)
+  :param downsample_method: (optional) how series are downsampled (lttb or min_max)
+  """
   resp = []
 
-  for graph in sorted(graphs, key=attrgetter('created_at'), reverse=True):
+  for graph in graphs:
     formatted_graph = {
       'uid': graph.uid,
       'title': graph.title,
@@ -13,9 +30,10 @@ def formatted_graphs(graphs):
       'data_groups': []
     }
 
-    for group in sorted(graph.graph_data_groups, key=attrgetter('created_at'), reverse=True):
-      data = [data_point.data for data_point in group.graph_data_points]
-      data.sort(key=lambda d: d['x'])
+    for group in graph.graph_data_groups:
+      x, y = graph_series.read_chunks(group.graph_data_chunks)
+      x, y = downsample.downsample(x, y, max_points=max_points, method=downsample_method)
+      data = [{'x': x_val, 'y': y_val} for x_val, y_val in zip(x.tolist(), y.tolist())]
 
       formatted_group = {
         'name': group.name,
@@ -27,4 +45,72 @@ def formatted_graphs(graphs):
 
     resp.append(formatted_graph)
 
-  return resp
\ No newline at end of file
+  return resp
+
+
+def publish_new_points(graphs, new_points):
+  """
+  Publish the points just added to each graph.
+
+  Usually only the new points of each series are published ('delta': True), which clients append to
+  what they have. At most once every SNAPSHOT_INTERVAL per deployment, its full graphs are published
+  instead ('delta': False), so late joiners catch up.
+
+  :param graphs:     (required) graphs points were added to
+  :param new_points: (required) dict of graph_uid --> {series: {'color': color, 'data': [new points]}}
+  """
+  graphs = [g for g in graphs if g.uid in new_points]
+
+  snapshot_deployment_ids = [deployment_id for deployment_id in {g.deployment_id for g in graphs}
+                             if redis.set(snapshot_key(deployment_id), 1, nx=True, ex=SNAPSHOT_INTERVAL)]
+
+  for graph in graphs:
+    if graph.deployment_id in snapshot_deployment_ids:
+      continue
+
+    publish(graph.uid, {'delta': True, 'graphs': [formatted_graph_delta(graph, new_points[graph.uid])]})
+
+  if not snapshot_deployment_ids:
+    return
+
+  deployments = db.session.query(Deployment).options(
+    joinedload(Deployment.graphs)
+      .subqueryload(Graph.graph_data_groups)
+      .subqueryload(GraphDataGroup.graph_data_chunks)).filter(Deployment.id.in_(snapshot_deployment_ids)).all()
+
+  for deployment in deployments:
+    payload = {'delta': False, 'graphs': formatted_graphs(deployment.graphs)}
+
+    for graph in deployment.graphs:
+      if graph.uid in new_points:
+        publish(graph.uid, payload)
+
+
+def formatted_graph_delta(graph, new_series_points):
+  return {
+    'uid': graph.uid,
+    'data_groups': [{
+      'name': name,
+      'color': series['color'],
+      'new_data': sorted(series['data'], key=lambda d: d['x'])
+    } for name, series in new_series_points.items()]
+  }
+
+
+def snapshot_key(deployment_id):
+  return 'graph-snapshot-published:{}'.format(deployment_id)
+
+
+def downsample_args(args):
+  """
+  Parse the downsampling params (max_points, downsample) of a graphs request into formatted_graphs kwargs.
+
+  :raises ValueError: if either param is invalid
+  """
+  max_points = int(args['max_points']) if args.get('max_points') else None
+  method = args.get('downsample') or downsample.LTTB
+
+  if (max_points is not None and max_points < downsample.MIN_POINTS) or method not in downsample.METHODS:
+    raise ValueError('Invalid downsampling params')
+
+  return {'max_points': max_points, 'downsample_method': method}
@@ -19,7 +19,8 @@ Tables:
   Env
   Graph
   GraphDataGroup
-  GraphDataPoint
+  GraphDataChunk
+  LogArchive
 
 Relationships:
 
@@ -62,8 +63,10 @@ Relationships:
   Graph --> belongs_to --> Deployment
   Graph --> has_many --> graph_data_groups
   GraphDataGroup --> belongs_to --> Graph
-  GraphDataGroup --> has_many --> graph_data_points
-  GraphDataPoint --> belongs_to --> GraphDataGroup
+  GraphDataGroup --> has_many --> graph_data_chunks
+  GraphDataChunk --> belongs_to --> GraphDataGroup
+  Deployment --> has_many --> log_archives
+  LogArchive --> belongs_to --> Deployment
 """
 import datetime
 import importlib
@@ -701,6 +704,9 @@ class Deployment(db.Model):
   def train_log(self):
     return 'train:{}'.format(self.uid)
 
+  def done_training_log(self):
+    return 'done-training:{}'.format(self.uid)
+
 
 class TrainJob(db.Model):
   id = db.Column(db.Integer, primary_key=True)
@@ -812,7 +818,7 @@ class Graph(db.Model):
   id = db.Column(db.Integer, primary_key=True)
   uid = db.Column(db.String, index=True, unique=True, nullable=False)
   deployment_id = db.Column(db.Integer, db.ForeignKey('deployment.id'), index=True, nullable=False)
-  deployment = db.relationship('Deployment', backref='graphs')
+  deployment = db.relationship('Deployment', backref=db.backref('graphs', order_by='Graph.created_at.desc()'))
   title = db.Column(db.String)
   x_axis = db.Column(db.String)
   y_axis = db.Column(db.String)
@@ -840,7 +846,7 @@ class GraphDataGroup(db.Model):
   id = db.Column(db.Integer, primary_key=True)
   uid = db.Column(db.String, index=True, unique=True, nullable=False)
   graph_id = db.Column(db.Integer, db.ForeignKey('graph.id'), index=True, nullable=False)
-  graph = db.relationship('Graph', backref='graph_data_groups')
+  graph = db.relationship('Graph', backref=db.backref('graph_data_groups', order_by='GraphDataGroup.created_at.desc()'))
   name = db.Column(db.String)
   color = db.Column(db.String)
   created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -862,23 +868,67 @@ class GraphDataGroup(db.Model):
       self.id, self.uid, self.graph_id, self.name, self.color, self.created_at, self.is_destroyed)
 
 
-class GraphDataPoint(db.Model):
+class GraphDataChunk(db.Model):
+  # A group's chunks cover non-overlapping x ranges, so reading them by x_min yields the series in x order
+  __table_args__ = (
+    db.Index('ix_graph_data_chunk_graph_data_group_id_x_min', 'graph_data_group_id', 'x_min'),
+  )
+
   id = db.Column(db.Integer, primary_key=True)
-  graph_data_group_id = db.Column(db.Integer, db.ForeignKey('graph_data_group.id'), index=True, nullable=False)
-  graph_data_group = db.relationship('GraphDataGroup', backref='graph_data_points')
-  data = db.Column(db.JSON)
+  graph_data_group_id = db.Column(db.Integer, db.ForeignKey('graph_data_group.id'), nullable=False)
+  graph_data_group = db.relationship('GraphDataGroup', backref=db.backref('graph_data_chunks',
+                                                                          order_by='GraphDataChunk.x_min'))
+  x_data = db.Column(db.LargeBinary)  # packed little-endian float64 x values (sorted)
+  y_data = db.Column(db.LargeBinary)  # packed little-endian float64 y values
+  num_points = db.Column(db.Integer, server_default='0')
+  x_min = db.Column(db.Float)
+  x_max = db.Column(db.Float)
   created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+  updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
-  def __init__(self, graph_data_group=None, graph_data_group_id=None, data=None):
-    self.uid = uuid4().hex
-
+  def __init__(self, graph_data_group=None, graph_data_group_id=None, x_data=b'', y_data=b'', num_points=0,
+               x_min=None, x_max=None):
     if graph_data_group_id:
       self.graph_data_group_id = graph_data_group_id
     else:
       self.graph_data_group = graph_data_group
 
-    self.data = data or {}
+    self.x_data = x_data
+    self.y_data = y_data
+    self.num_points = num_points
+    self.x_min = x_min
+    self.x_max = x_max
+
+  def __repr__(self):
+    return '<GraphDataChunk id={}, graph_data_group_id={}, num_points={}, x_min={}, x_max={}, created_at={}, ' \
+           'updated_at={}>'.format(self.id, self.graph_data_group_id, self.num_points, self.x_min, self.x_max,
+                                   self.created_at, self.updated_at)
+
+
+class LogArchive(db.Model):
+  id = db.Column(db.Integer, primary_key=True)
+  deployment_id = db.Column(db.Integer, db.ForeignKey('deployment.id'), index=True, nullable=False)
+  deployment = db.relationship('Deployment', backref='log_archives')
+  stream_key = db.Column(db.String, index=True, unique=True, nullable=False)
+  entries = db.Column(db.LargeBinary)  # zlib-compressed JSON list of [entry_id, data] pairs
+  num_entries = db.Column(db.Integer, server_default='0')
+  last_entry_id = db.Column(db.String)
+  created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+  updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+  def __init__(self, deployment=None, deployment_id=None, stream_key=None, entries=None, num_entries=0,
+               last_entry_id=None):
+    if deployment_id:
+      self.deployment_id = deployment_id
+    else:
+      self.deployment = deployment
+
+    self.stream_key = stream_key
+    self.entries = entries
+    self.num_entries = num_entries
+    self.last_entry_id = last_entry_id
 
   def __repr__(self):
-    return '<GraphDataPoint id={}, graph_data_group_id={}, data={}, created_at={}>'.format(
-      self.id, self.graph_data_group_id, self.data, self.created_at)
\ No newline at end of file
+    return '<LogArchive id={}, deployment_id={}, stream_key={}, num_entries={}, last_entry_id={}, created_at={}, ' \
+           'updated_at={}>'.format(self.id, self.deployment_id, self.stream_key, self.num_entries,
+                                   self.last_entry_id, self.created_at, self.updated_at)
\ No newline at end of file
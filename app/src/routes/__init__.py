@@ -12,4 +12,5 @@ from repo import *
 from user import *
 from env import *
 from graph import *
-from demo import *
\ No newline at end of file
+from demo import *
+from stats import *
\ No newline at end of file
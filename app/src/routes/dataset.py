@@ -1,4 +1,4 @@
-from flask import request
+from flask import request, Response, stream_with_context
 from flask_restplus import Resource, fields
 from src.routes import namespace, api
 from src.models import Provider, Dataset, Team, Repo, RepoProviderUser
@@ -7,13 +7,17 @@ from src.helpers.provider_user_helper import current_provider_user
 from src.api_responses.errors import *
 from src.api_responses.success import *
 from src.services.dataset_services.create_dataset import CreateDataset
+from src.services.dataset_services.append_records import AppendRecords
 from src.helpers.provider_helper import parse_git_url
 from src.utils import dataset_db
-from src.helpers import utcnow_to_ts
+from src.helpers import utcnow_to_ts, dataset_storage_modes
 from src.utils.job_queue import job_queue
 from src.utils.slug import to_slug
 from src.services.env_services.update_deploy_env import UpdateDeployEnv
 
+# Content types accepted as a raw (non-multipart) dataset upload body
+RAW_UPLOAD_MIMETYPES = ('application/json', 'application/gzip', 'application/zstd', 'application/octet-stream')
+
 update_dataset_model = api.model('Dataset', {
   'uid': fields.String(required=True),
   'retrainStepSize': fields.Integer(required=True)
@@ -31,10 +35,14 @@ class RestfulDataset(Resource):
     if not provider_user:
       return UNAUTHORIZED
 
-    # Get refs to payload info
-    payload = dict(request.form.items())
+    # Get refs to payload info (in the query string for raw-body uploads)
+    payload = dict(request.form.items()) or dict(request.args.items())
     git_url = payload.get('git_url')
     dataset_slug = payload.get('dataset_slug')
+    storage = payload.get('storage') or dataset_storage_modes.JSON
+
+    if storage not in (dataset_storage_modes.JSON, dataset_storage_modes.TYPED):
+      return INVALID_INPUT_PAYLOAD
 
     provider_domain, team_name, repo_name = parse_git_url(git_url)
 
@@ -48,8 +56,7 @@ class RestfulDataset(Resource):
       return PROVIDER_MISMATCH
 
     # Get dataset file
-    files = dict(request.files.items()) or {}
-    f = files.get('file')
+    f, content_encoding = get_upload()
 
     if not f:
       return NO_FILE_PROVIDED
@@ -91,7 +98,7 @@ class RestfulDataset(Resource):
 
     try:
       # Create the dataset
-      svc = CreateDataset(dataset_slug, repo=repo, fileobj=f)
+      svc = CreateDataset(dataset_slug, repo=repo, fileobj=f, content_encoding=content_encoding, storage=storage)
       svc.perform()
 
       # If first dataset for repo and an API deploy exists, update its DATASET_TABLE_NAME env var.
@@ -190,6 +197,105 @@ class RestfulDataset(Resource):
     return DATASET_SUCCESSFULLY_DELETED
 
 
+@namespace.route('/dataset/records')
+class RestfulDatasetRecords(Resource):
+  """Restful interface for the records inside a Dataset's table"""
+
+  @namespace.doc('export_dataset_records')
+  def get(self):
+    provider_user = current_provider_user()
+
+    if not provider_user:
+      return UNAUTHORIZED
+
+    args = dict(request.args.items())
+    dataset_uid = args.get('uid')
+
+    if not dataset_uid:
+      return INVALID_INPUT_PAYLOAD
+
+    # Parse keyset pagination params
+    try:
+      after_id = int(args.get('after_id') or 0)
+      limit = int(args['limit']) if args.get('limit') else None
+    except ValueError:
+      return INVALID_INPUT_PAYLOAD
+
+    if limit is not None and limit < 0:
+      return INVALID_INPUT_PAYLOAD
+
+    # Find dataset for provided uid
+    dataset = dbi.find_one(Dataset, {'uid': dataset_uid})
+
+    if not dataset:
+      return DATASET_NOT_FOUND
+
+    # Make sure this provider_user is associated with this dataset (through repo)
+    repo_provider_user = dbi.find_one(RepoProviderUser, {
+      'repo': dataset.repo,
+      'provider_user': provider_user
+    })
+
+    if not repo_provider_user:
+      return REPO_PROVIDER_USER_NOT_FOUND
+
+    # Respond with a stream of NDJSON records
+    records = dataset_db.export_records(table=dataset.table(), after_id=after_id, limit=limit)
+
+    return Response(stream_with_context(records),
+                    mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
+
+  @namespace.doc('append_dataset_records')
+  def post(self):
+    provider_user = current_provider_user()
+
+    if not provider_user:
+      return UNAUTHORIZED
+
+    payload = dict(request.form.items()) or dict(request.args.items())
+    dataset_uid = payload.get('uid')
+
+    if not dataset_uid:
+      return INVALID_INPUT_PAYLOAD
+
+    # Get file of new records
+    f, content_encoding = get_upload()
+
+    if not f:
+      return NO_FILE_PROVIDED
+
+    # Find dataset for provided uid
+    dataset = dbi.find_one(Dataset, {'uid': dataset_uid})
+
+    if not dataset:
+      return DATASET_NOT_FOUND
+
+    # Make sure this provider_user is associated with this dataset (through repo)
+    repo_provider_user = dbi.find_one(RepoProviderUser, {
+      'repo': dataset.repo,
+      'provider_user': provider_user
+    })
+
+    if not repo_provider_user:
+      return REPO_PROVIDER_USER_NOT_FOUND
+
+    # Make sure repo_provider_user has write access to this repo (and therefore, its datasets)
+    if not repo_provider_user.has_write_access():
+      return UNAUTHORIZED
+
+    try:
+      svc = AppendRecords(dataset=dataset, fileobj=f, content_encoding=content_encoding)
+      svc.perform()
+    except BaseException as e:
+      logger.error('Error appending records to Dataset(uid={}): {}'.format(dataset_uid, e))
+      return DATASET_APPEND_FAILED
+
+    logger.info('Appended {} records to Dataset(uid={}).'.format(svc.num_appended, dataset_uid))
+
+    return DATASET_RECORDS_SUCCESSFULLY_APPENDED
+
+
 @namespace.route('/datasets')
 class RestfulDataset(Resource):
   """Restful interface for the Dataset model, continued"""
@@ -237,15 +343,18 @@ class RestfulDataset(Resource):
     if not repo_provider_user:
       return REPO_PROVIDER_USER_NOT_FOUND
 
+    # Fetch record counts and previews for all of the repo's datasets in one go
+    summaries = dataset_db.summaries([d.table() for d in repo.datasets], preview_limit=5)
+
     datasets = [{
       'name': d.name,
       'uid': d.uid,
-      'num_records': dataset_db.record_count(table=d.table()),
+      'num_records': summaries[d.table()]['num_records'],
       'retrain_step_size': d.retrain_step_size,
       'last_train_record_count': d.last_train_record_count,
       'created_at': utcnow_to_ts(d.created_at),
       'has_write_access': repo_provider_user.has_write_access(),
-      'preview': dataset_db.sample(table=d.table(), limit=5)
+      'preview': summaries[d.table()]['preview']
     } for d in repo.datasets]
 
     return {'datasets': datasets}
@@ -286,4 +395,25 @@ class RestfulDataset(Resource):
 
     preview_records = dataset_db.sample(table=dataset.table(), limit=10)
 
-    return {'preview': preview_records}
\ No newline at end of file
+    return {'preview': preview_records}
+
+
+def get_upload():
+  """
+  Get the uploaded dataset file and its declared Content-Encoding (if any).
+
+  Accepts either a multipart upload (request.files['file']) or a raw request body. A raw body is read
+  straight off the request stream rather than being spooled to a temp file by Werkzeug first.
+
+  :return: tuple --> (file-like object or None, content encoding or None)
+  """
+  files = dict(request.files.items()) or {}
+  f = files.get('file')
+
+  if f:
+    return f, f.headers.get('Content-Encoding') or request.headers.get('Content-Encoding')
+
+  if request.mimetype in RAW_UPLOAD_MIMETYPES and request.content_length:
+    return request.stream, request.headers.get('Content-Encoding')
+
+  return None, None
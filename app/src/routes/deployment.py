@@ -1,6 +1,6 @@
 import os
 from flask_restplus import Resource, fields
-from flask import request, Response, stream_with_context
+from flask import request, Response, stream_with_context, redirect
 from src.helpers import utcnow_to_ts
 from src.routes import namespace, api
 from src.models import Provider, Deployment, Team, Repo, RepoProviderUser, Commit, ProviderUser
@@ -8,11 +8,11 @@ from src import logger, dbi, db
 from src.helpers.provider_user_helper import current_provider_user
 from src.api_responses.errors import *
 from src.api_responses.success import *
-from src.utils import clusters, log_streamer, dataset_db
+from src.utils import clusters, log_streamer, dataset_db, log_archive
+from src.config import config
 from src.helpers.definitions import core_header_name
 from src.deploys.build_server_deploy import BuildServerDeploy
 from src.utils.job_queue import job_queue
-from src.utils.pyredis import redis
 from src.utils.pred_messenger import PredMessenger
 from src.utils.log_formatter import training_log
 from src.utils.slug import to_slug
@@ -94,7 +94,7 @@ class DeploymentTrained(Resource):
 
     # Enqueue this message in order to force the deployment_update_queue to broadcast an update.
     logger.info('Done training.',
-                stream='done-training:{}'.format(deployment.uid),
+                stream=deployment.done_training_log(),
                 stage=deployment.statuses.DONE_TRAINING)
 
     # Update the Dataset's last_train_record_count
@@ -242,8 +242,7 @@ class ApiDeployment(Resource):
       return API_DEPLOYMENT_SUCCESS
 
     # Respond with a stream of the deploy logs
-    return Response(stream_with_context(log_streamer.stream_deploy_logs(deployment, stream_key=log_stream_key)),
-                    headers={'X-Accel-Buffering': 'no'})
+    return log_stream_response(deployment, log_streamer.DEPLOY_LOGS, stream_key=log_stream_key)
 
 
 @namespace.route('/deployment/logs')
@@ -304,17 +303,27 @@ class TrainDeployment(Resource):
       deployment = deployments[0]
 
     follow_logs = args.get('follow') == 'true'  # Do they want to follow the real-time logs or no?
+    all_stages = args.get('all_stages') == 'true'  # Do they want every stage's logs (deploys + training) or just training?
+
+    # Reconnecting clients pick up where their last stream left off
+    resume_token = request.headers.get('Last-Event-ID') or args.get('resume_token')
+    with_resume_tokens = args.get('resume_tokens') == 'true' or bool(resume_token)
+
+    if follow_logs and all_stages:
+      # Stream the deployment's whole lifecycle through one connection
+      return log_stream_response(deployment, log_streamer.ALL_LOGS, resume_token=resume_token,
+                                 with_resume_tokens=with_resume_tokens)
 
     if follow_logs:
       # Stream real-time training logs for the latest deploy
-      return Response(stream_with_context(log_streamer.stream_train_logs(deployment)),
-                      headers={'X-Accel-Buffering': 'no'})
+      return log_stream_response(deployment, log_streamer.TRAIN_LOGS, resume_token=resume_token,
+                                 with_resume_tokens=with_resume_tokens)
     else:
       # Following real-time logs is NOT desired here. Just send back a dump of
       # all the current logs up to this point.
 
-      # Get all logs from redis stream
-      current_logs = redis.xrange(deployment.train_log())
+      # Get all logs from the redis stream (or its archive if it's expired)
+      current_logs = log_archive.read_stream(deployment.train_log())
 
       if not current_logs:
         return NO_LOGS_TO_SHOW
@@ -586,5 +595,25 @@ def perform_train_deploy(intent=None):
     return DEPLOYMENT_CREATION_SUCCESS
 
   # Respond with a stream of the deploy logs
-  return Response(stream_with_context(log_streamer.stream_deploy_logs(deployment, stream_key=log_stream_key)),
+  return log_stream_response(deployment, log_streamer.DEPLOY_LOGS, stream_key=log_stream_key)
+
+
+def log_stream_response(deployment, kind, stream_key=None, resume_token=None, with_resume_tokens=False):
+  """
+  Respond with a stream of a deployment's logs.
+
+  If a log stream server is configured, the (potentially hours-long) stream is handed off to it
+  with a redirect carrying a single-use token, rather than tying up this worker.
+  """
+  stream_opts = {
+    'stream_key': stream_key,
+    'resume_token': resume_token,
+    'with_resume_tokens': with_resume_tokens
+  }
+
+  if config.LOG_STREAM_URL:
+    token = log_streamer.issue_handoff_token(deployment, kind, **stream_opts)
+    return redirect('{}/logs?token={}'.format(config.LOG_STREAM_URL.rstrip('/'), token), code=303)
+
+  return Response(stream_with_context(log_streamer.open_stream(deployment, kind, **stream_opts)),
                   headers={'X-Accel-Buffering': 'no'})
\ No newline at end of file
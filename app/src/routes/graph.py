@@ -3,13 +3,14 @@ from flask import request
 from flask_restplus import Resource, fields
 from src.routes import namespace, api
 from src import dbi, logger, db
-from src.models import Deployment, Graph, GraphDataGroup, GraphDataPoint
+from src.models import Deployment, Graph, GraphDataGroup
 from sqlalchemy.orm import joinedload
 from src.api_responses.errors import *
 from src.api_responses.success import *
 from src.helpers.provider_user_helper import current_provider_user
-from src.helpers.graph_helper import formatted_graphs
+from src.helpers.graph_helper import formatted_graphs, publish_new_points, downsample_args
 from src.helpers.definitions import train_cluster_header_name, core_header_name
+from src.services.graph_services.add_graph_data_points import AddGraphDataPoints
 
 create_graph_model = api.model('Graph', {
   'deployment_uid': fields.String(required=True),
@@ -18,6 +19,18 @@ create_graph_model = api.model('Graph', {
   'y_axis': fields.String(required=True)
 })
 
+graph_data_point_model = api.model('GraphDataPoint', {
+  'graph_uid': fields.String(required=True),
+  'series': fields.String(),
+  'color': fields.String(),
+  'x': fields.Raw(required=True),
+  'y': fields.Raw(required=True)
+})
+
+add_graph_data_points_model = api.model('GraphDataPoints', {
+  'points': fields.List(fields.Nested(graph_data_point_model), required=True)
+})
+
 
 @namespace.route('/graphs')
 class RestfulEnvs(Resource):
@@ -37,16 +50,22 @@ class RestfulEnvs(Resource):
       logger.error('No deployment_uid provided when fetching graphs for deployment.')
       return INVALID_INPUT_PAYLOAD
 
+    # Parse downsampling params (max points per series and method)
+    try:
+      downsample_opts = downsample_args(args)
+    except ValueError:
+      return INVALID_INPUT_PAYLOAD
+
     deployment = db.session.query(Deployment).options(
       joinedload(Deployment.graphs)
       .subqueryload(Graph.graph_data_groups)
-      .subqueryload(GraphDataGroup.graph_data_points)).filter(Deployment.uid == deployment_uid).first()
+      .subqueryload(GraphDataGroup.graph_data_chunks)).filter(Deployment.uid == deployment_uid).first()
 
     if not deployment:
       logger.error('No deployment found for uid: {}'.format(deployment_uid))
       return DEPLOYMENT_NOT_FOUND
 
-    graphs = formatted_graphs(deployment.graphs)
+    graphs = formatted_graphs(deployment.graphs, **downsample_opts)
 
     return {'graphs': graphs}
 
@@ -86,4 +105,32 @@ class RestfulEnvs(Resource):
       'y_axis': y_axis
     })
 
-    return {'uid': graph.uid}
\ No newline at end of file
+    return {'uid': graph.uid}
+
+
+@namespace.route('/graph/points')
+class RestfulGraphDataPoints(Resource):
+  """Restful interface for adding data points to Graphs in bulk"""
+
+  @namespace.doc('add_graph_data_points')
+  @namespace.expect(add_graph_data_points_model, validate=True)
+  def post(self):
+    if request.headers.get(core_header_name) != os.environ.get('CORE_API_TOKEN'):
+      return UNAUTHORIZED
+
+    if request.headers.get(train_cluster_header_name) != os.environ.get('TENSORCI_TRAIN_SECRET'):
+      return UNAUTHORIZED
+
+    payload = api.payload or {}
+
+    try:
+      svc = AddGraphDataPoints(points=payload['points'])
+      svc.perform()
+    except BaseException as e:
+      logger.error('Error adding graph data points: {}'.format(e))
+      db.session.rollback()
+      return ERROR_ADDING_GRAPH_DATA_POINTS
+
+    publish_new_points(svc.graphs, svc.new_points)
+
+    return {'ok': True, 'num_added': svc.num_added}, 201
\ No newline at end of file
@@ -9,12 +9,12 @@ from src.helpers.provider_user_helper import current_provider_user
 from src import logger, dbi, db
 from sqlalchemy.orm import joinedload
 from src.helpers import auth_util, utcnow_to_ts
-from src.models import Team, Repo, RepoProviderUser, Provider, TeamProviderUser, Deployment, Graph, GraphDataGroup, GraphDataPoint
+from src.models import Team, Repo, RepoProviderUser, Provider, TeamProviderUser, Deployment, Graph, GraphDataGroup
 from src.helpers.provider_helper import parse_git_url
 from src.services.team_services.create_team import CreateTeam
 from src.utils import dataset_db
 from src.utils.slug import to_slug
-from src.helpers.graph_helper import formatted_graphs
+from src.helpers.graph_helper import formatted_graphs, downsample_args
 
 create_repo_model = api.model('Repo', {
   'repo_name': fields.String(required=True),
@@ -148,15 +148,18 @@ class RestfulRepos(Resource):
       if not repo_provider_user:
         return REPO_PROVIDER_USER_NOT_FOUND
 
+      # Fetch record counts and previews for all of the repo's datasets in one go
+      summaries = dataset_db.summaries([d.table() for d in repo.datasets], preview_limit=5)
+
       resp['datasets'] = [{
         'name': d.name,
         'uid': d.uid,
-        'num_records': dataset_db.record_count(table=d.table()),
+        'num_records': summaries[d.table()]['num_records'],
         'retrain_step_size': d.retrain_step_size,
         'last_train_record_count': d.last_train_record_count,
         'created_at': utcnow_to_ts(d.created_at),
         'has_write_access': repo_provider_user.has_write_access(),
-        'preview': dataset_db.sample(table=d.table(), limit=5)
+        'preview': summaries[d.table()]['preview']
       } for d in repo.datasets]
 
     return resp
@@ -575,6 +578,12 @@ class RestfulRepos(Resource):
       logger.error('No team provided during request for metrics.')
       return INVALID_INPUT_PAYLOAD
 
+    # Parse downsampling params (max points per series and method)
+    try:
+      downsample_opts = downsample_args(args)
+    except ValueError:
+      return INVALID_INPUT_PAYLOAD
+
     team_slug = team_slug.lower()
     team = dbi.find_one(Team, {'slug': team_slug})
 
@@ -666,7 +675,7 @@ class RestfulRepos(Resource):
         deployment = db.session.query(Deployment).options(
           joinedload(Deployment.graphs)
             .subqueryload(Graph.graph_data_groups)
-            .subqueryload(GraphDataGroup.graph_data_points))\
+            .subqueryload(GraphDataGroup.graph_data_chunks))\
           .filter(Deployment.uid == deployment_uid).first()
 
         if not deployment:
@@ -674,7 +683,7 @@ class RestfulRepos(Resource):
           return DEPLOYMENT_NOT_FOUND
 
         resp['uid'] = deployment_uid
-        resp['graphs'] = formatted_graphs(deployment.graphs)
+        resp['graphs'] = formatted_graphs(deployment.graphs, **downsample_opts)
 
     return resp
 
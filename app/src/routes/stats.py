@@ -0,0 +1,22 @@
+import os
+from flask import request
+from flask_restplus import Resource
+from src.routes import namespace
+from src.api_responses.errors import *
+from src.helpers.definitions import core_header_name
+from src.utils import log_streamer, dataset_db
+
+
+@namespace.route('/stats')
+class RestfulStats(Resource):
+  """Internal runtime stats for this API process"""
+
+  @namespace.doc('get_stats')
+  def get(self):
+    if request.headers.get(core_header_name) != os.environ.get('CORE_API_TOKEN'):
+      return UNAUTHORIZED
+
+    return {
+      'log_tails': log_streamer.tail_metrics(),
+      'dataset_db_pool': dataset_db.pool_metrics() if dataset_db.engine else None
+    }
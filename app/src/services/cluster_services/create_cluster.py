@@ -1,5 +1,6 @@
 import os
 from src import dbi, logger
+from src.utils.logger import buffered
 from src.models import Team, Cluster, Deployment
 from src.deploys.api_deploy import ApiDeploy
 from src.utils.aws import create_route53_hosted_zone, add_dns_records, os_map
@@ -22,6 +23,7 @@ class CreateCluster(object):
     self.log_stream_key = None
     self.stage = None
 
+  @buffered
   def perform(self):
     self.set_db_reliant_attrs()
 
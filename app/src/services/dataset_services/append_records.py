@@ -0,0 +1,18 @@
+from src.utils import dataset_db
+from src.helpers.dataset_helper import read_records
+
+
+class AppendRecords(object):
+
+  def __init__(self, dataset=None, fileobj=None, content_encoding=None):
+    self.dataset = dataset
+    self.fileobj = fileobj
+    self.content_encoding = content_encoding
+    self.num_appended = 0
+
+  def perform(self):
+    # Lazily decompress (if needed) and parse the JSON file, one array element at a time (ensures data is a JSON array)
+    records = read_records(self.fileobj, content_encoding=self.content_encoding)
+
+    # Stream the new records onto the end of the dataset's existing table
+    self.num_appended = dataset_db.append_records(records, table=self.dataset.table())
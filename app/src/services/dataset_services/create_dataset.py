@@ -1,34 +1,63 @@
-import json
+from itertools import chain, islice
 from src import logger, dbi
 from src.models import Dataset
-from src.utils import dataset_db
+from src.utils import dataset_db, dataset_schema
+from src.helpers import dataset_storage_modes
+from src.helpers.dataset_helper import read_records
 
 
 class CreateDataset(object):
 
-  def __init__(self, name, repo=None, fileobj=None):
+  def __init__(self, name, repo=None, fileobj=None, content_encoding=None, storage=dataset_storage_modes.JSON):
     self.name = name
     self.repo = repo
     self.fileobj = fileobj
+    self.content_encoding = content_encoding
+    self.storage = storage
     self.dataset = None
 
   def perform(self):
-    # Create Dataset record in core DB
+    # Lazily decompress (if needed) and parse the JSON file, one array element at a time (ensures data is a JSON array)
+    records = read_records(self.fileobj, content_encoding=self.content_encoding)
+
+    schema = None
+
+    # For typed storage, infer the table's columns from the leading records
+    if self.storage == dataset_storage_modes.TYPED:
+      try:
+        sample = list(islice(records, dataset_schema.SAMPLE_SIZE))
+        schema = dataset_schema.infer_schema(sample)
+      except ValueError as e:
+        raise BaseException(str(e))
+
+      records = chain(sample, records)
+
+    # Create Dataset record in core DB (once the start of the upload checks out)
     self.dataset = dbi.create(Dataset, {
       'repo': self.repo,
       'name': self.name
     })
 
-    # Parse the JSON file
-    data = json.loads(self.fileobj.read())
-
-    # Ensure data is a list
-    if type(data) != list:
-      raise BaseException('Data is not a JSON array')
-
-    # Create a new table in our dataset DB for the dataset's records
     table_name = self.dataset.table()
-    dataset_db.create_table(table_name)
-
-    # Batch insert the data into the table
-    dataset_db.populate_records(data, table=table_name)
\ No newline at end of file
+    table_created = False
+
+    try:
+      # Create a new table in our dataset DB for the dataset's records
+      dataset_db.create_table(table_name, schema=schema)
+      table_created = True
+
+      # Stream the records into the table
+      dataset_db.populate_records(records, table=table_name)
+    except BaseException:
+      # Records further into the upload can still be bad -- don't leave a half-created dataset holding its slug
+      self.remove_dataset(table_created)
+      raise
+
+  def remove_dataset(self, table_created):
+    try:
+      if table_created:
+        dataset_db.drop_table(self.dataset.table())
+
+      dbi.delete(self.dataset)
+    except BaseException as e:
+      logger.error('Error removing partially created Dataset(uid={}): {}'.format(self.dataset.uid, e))
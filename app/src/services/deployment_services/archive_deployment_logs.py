@@ -0,0 +1,70 @@
+from datetime import datetime
+from src import dbi, logger
+from src.models import Deployment, LogArchive
+from src.utils import log_archive, log_stage_index
+from src.utils.log_hub import parse_id, latest_id
+from src.utils.pyredis import redis
+
+
+class ArchiveDeploymentLogs(object):
+  # Times a stream is re-archived if new entries keep landing on it while it's being archived
+  MAX_ATTEMPTS = 3
+
+  def __init__(self, deployment_uid=None):
+    self.deployment_uid = deployment_uid
+    self.deployment = None
+
+  def perform(self):
+    self.deployment = dbi.find_one(Deployment, {'uid': self.deployment_uid})
+
+    if not self.deployment:
+      logger.error('No deployment found for uid: {}. Not archiving logs.'.format(self.deployment_uid))
+      return
+
+    for stream_key in log_archive.deployment_stream_keys(self.deployment):
+      for i in range(self.MAX_ATTEMPTS):
+        last_entry_id = self.archive_stream(stream_key)
+
+        if not last_entry_id:
+          break
+
+        # Only let the hot stream expire if nothing was added to it since it was read
+        if latest_id(stream_key) == last_entry_id:
+          redis.expire(stream_key, log_archive.STREAM_TTL)
+          redis.expire(log_stage_index.index_key(stream_key), log_archive.STREAM_TTL)
+          break
+
+  def archive_stream(self, stream_key):
+    """
+    Save a stream's current contents to its LogArchive.
+
+    :return: id of the last entry archived (None if the stream isn't in redis)
+    """
+    entries = redis.xrange(stream_key)
+
+    if not entries:
+      return None
+
+    archive = dbi.find_one(LogArchive, {'stream_key': stream_key})
+
+    if archive:
+      # Keep archived entries older than what's left in redis, in case the stream expired and was written to again
+      first_id = parse_id(entries[0][0])
+      entries = [entry for entry in log_archive.decompress_entries(archive.entries)
+                 if parse_id(entry[0]) < first_id] + entries
+
+    params = {
+      'entries': log_archive.compress_entries(entries),
+      'num_entries': len(entries),
+      'last_entry_id': entries[-1][0]
+    }
+
+    if archive:
+      params['updated_at'] = datetime.utcnow()
+      dbi.update(archive, params)
+    else:
+      params['deployment'] = self.deployment
+      params['stream_key'] = stream_key
+      dbi.create(LogArchive, params)
+
+    return entries[-1][0]
@@ -0,0 +1,181 @@
+import math
+import numpy as np
+from collections import OrderedDict
+from datetime import datetime
+from src import db, dbi
+from src.models import Graph, GraphDataGroup, GraphDataChunk
+from src.utils import graph_series
+
+
+class AddGraphDataPoints(object):
+
+  def __init__(self, points=None):
+    self.points = points or []
+    self.graphs = []
+    self.new_points = {}  # graph_uid --> {series: {'color': color, 'data': [points added]}}
+    self.num_added = 0
+
+  def perform(self):
+    points = [p for p in (self.parse_point(point) for point in self.points) if p]
+
+    if not points:
+      return
+
+    # Get all graphs for these points in one query
+    self.graphs = dbi.find_all(Graph, {'uid': list({p['graph_uid'] for p in points})})
+
+    if not self.graphs:
+      return
+
+    graphs_map = {g.uid: g for g in self.graphs}
+    points = [p for p in points if p['graph_uid'] in graphs_map]
+
+    groups_map = self.upsert_groups(points, graphs_map)
+
+    # Group the points by series, keeping the order they came in
+    group_points = OrderedDict()
+
+    for p in points:
+      group = groups_map[(graphs_map[p['graph_uid']].id, p['series'])]
+      group_points.setdefault(group, []).append(p)
+
+    self.append_to_chunks(group_points)
+
+    db.session.commit()
+
+    self.num_added = len(points)
+
+    for group, series_points in group_points.items():
+      graph_uid = series_points[0]['graph_uid']
+
+      self.new_points.setdefault(graph_uid, {})[group.name] = {
+        'color': group.color,
+        'data': [{'x': p['x'], 'y': p['y']} for p in series_points]
+      }
+
+  @staticmethod
+  def parse_point(point):
+    if not isinstance(point, dict):
+      return None
+
+    graph_uid = point.get('graph_uid')
+
+    if not graph_uid:
+      return None
+
+    # Series are stored as float64s
+    try:
+      x = float(point.get('x'))
+      y = float(point.get('y'))
+    except (TypeError, ValueError):
+      return None
+
+    # NaN/inf (e.g. a diverged loss) can't be sorted by or served as JSON
+    if math.isinf(x) or math.isnan(x) or math.isinf(y) or math.isnan(y):
+      return None
+
+    return {
+      'graph_uid': graph_uid,
+      'series': point.get('series') or 'default',
+      'color': point.get('color'),
+      'x': x,
+      'y': y
+    }
+
+  @staticmethod
+  def upsert_groups(points, graphs_map):
+    """
+    Get (or create) the data group of every (graph, series) the points belong to, updating their colors.
+
+    :return: dict of (graph_id, series) --> GraphDataGroup
+    """
+    groups_map = {}
+
+    for group in dbi.find_all(GraphDataGroup, {'graph_id': [g.id for g in graphs_map.values()]}):
+      groups_map.setdefault((group.graph_id, group.name), group)
+
+    for p in points:
+      key = (graphs_map[p['graph_uid']].id, p['series'])
+      group = groups_map.get(key)
+
+      if not group:
+        group = GraphDataGroup(graph_id=key[0], name=p['series'])
+        db.session.add(group)
+        groups_map[key] = group
+
+      # Latest color given for a series wins
+      if p['color']:
+        group.color = p['color']
+
+    # Flush new groups (and color changes) so new groups get their ids before their chunks are written
+    db.session.flush()
+
+    return groups_map
+
+  @staticmethod
+  def append_to_chunks(group_points):
+    """
+    Add each group's new points to its chunks, keeping every chunk sorted by x and the group's chunks
+    in non-overlapping x ranges.
+
+    Points past the end of a series (the usual case) are appended to its last chunk and then new ones.
+    Points landing inside the series' existing range are merged into the chunks from there on, which
+    are rewritten.
+    """
+    # Lock the groups being written to (in id order, so writers can't deadlock). This serializes writers to a
+    # series even before it has any chunks, and every chunk read below (a new statement, under READ COMMITTED)
+    # then sees whatever the previous writer committed.
+    db.session.query(GraphDataGroup.id) \
+      .filter(GraphDataGroup.id.in_([g.id for g in group_points])) \
+      .order_by(GraphDataGroup.id) \
+      .with_for_update().all()
+
+    now = datetime.utcnow()
+
+    for group, points in group_points.items():
+      x = np.array([p['x'] for p in points], dtype=graph_series.DTYPE)
+      y = np.array([p['y'] for p in points], dtype=graph_series.DTYPE)
+
+      order = np.argsort(x, kind='mergesort')
+      x, y = x[order], y[order]
+
+      chunk = db.session.query(GraphDataChunk) \
+        .filter(GraphDataChunk.graph_data_group_id == group.id) \
+        .order_by(GraphDataChunk.x_min.desc(), GraphDataChunk.id.desc()) \
+        .first()
+
+      if chunk and x[0] < chunk.x_max:
+        overlapping = db.session.query(GraphDataChunk) \
+          .filter(GraphDataChunk.graph_data_group_id == group.id, GraphDataChunk.x_max > float(x[0])) \
+          .order_by(GraphDataChunk.x_min) \
+          .all()
+
+        old_x, old_y = graph_series.read_chunks(overlapping)
+
+        # Stable sort keeps existing points ahead of new ones with the same x
+        x = np.concatenate((old_x, x))
+        y = np.concatenate((old_y, y))
+        order = np.argsort(x, kind='mergesort')
+        x, y = x[order], y[order]
+
+        for old_chunk in overlapping:
+          db.session.delete(old_chunk)
+
+        chunk = None
+
+      i = 0
+
+      while i < len(x):
+        if not chunk or chunk.num_points >= graph_series.CHUNK_SIZE:
+          chunk = GraphDataChunk(graph_data_group_id=group.id, x_min=float(x[i]))
+          db.session.add(chunk)
+
+        num_points = min(graph_series.CHUNK_SIZE - chunk.num_points, len(x) - i)
+
+        chunk.x_data = bytes(chunk.x_data or b'') + graph_series.pack(x[i:i + num_points])
+        chunk.y_data = bytes(chunk.y_data or b'') + graph_series.pack(y[i:i + num_points])
+        chunk.num_points += num_points
+        chunk.x_max = float(x[i + num_points - 1])
+        chunk.updated_at = now
+
+        i += num_points
@@ -0,0 +1,154 @@
+"""
+Streaming decompression of uploaded files.
+
+Wraps a (possibly) compressed file object in a file-like reader that decompresses on the fly,
+a bounded chunk at a time, so compressed uploads can feed the ingest pipeline directly.
+
+Supported encodings: gzip, zstd (requires the zstandard package)
+"""
+import zlib
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Content-Encoding header values --> encoding
+CONTENT_ENCODINGS = {
+  'gzip': GZIP,
+  'x-gzip': GZIP,
+  'zstd': ZSTD
+}
+
+# Number of compressed bytes read from the underlying file object at a time
+READ_SIZE = 64 * 1024
+
+
+class DecompressingReader(object):
+  """
+  Read-only file-like object yielding the decompressed contents of a compressed file object.
+  """
+
+  def __init__(self, fileobj, encoding, head=b''):
+    self.fileobj = fileobj
+    self.encoding = encoding
+    self.pending = head
+    self.buf = b''
+    self.eof = False
+
+    if encoding == GZIP:
+      self.decompressor = gzip_decompressor()
+    elif encoding == ZSTD:
+      try:
+        import zstandard
+      except ImportError:
+        raise BaseException('zstd-compressed uploads require the zstandard package')
+
+      # zstd's stream reader only ever decompresses as much as each read asks for
+      self.zstd_reader = zstandard.ZstdDecompressor().stream_reader(PrefixedReader(fileobj, head), read_size=READ_SIZE)
+      self.zstd_reader.__enter__()
+    else:
+      raise BaseException('Unsupported content encoding: {}'.format(encoding))
+
+  def decompress(self, data, max_length):
+    # Cap the output size so a highly compressed chunk can't balloon in memory
+    out = self.decompressor.decompress(data, max_length)
+    self.pending = self.decompressor.unconsumed_tail
+
+    # Bodies can hold several concatenated gzip members -- move on to the next one
+    if self.decompressor.unused_data:
+      self.pending = self.decompressor.unused_data
+      self.decompressor = gzip_decompressor()
+
+    return out
+
+  def read(self, size=READ_SIZE):
+    if size is None or size < 0:
+      size = READ_SIZE
+
+    if self.encoding == ZSTD:
+      return self.zstd_reader.read(size)
+
+    while len(self.buf) < size and not self.eof:
+      data = self.pending or self.fileobj.read(READ_SIZE)
+      self.pending = b''
+
+      if not data:
+        self.eof = True
+        self.buf += self.decompressor.flush()
+        break
+
+      self.buf += self.decompress(data, size - len(self.buf))
+
+    out, self.buf = self.buf[:size], self.buf[size:]
+
+    return out
+
+
+def gzip_decompressor():
+  # 16 + MAX_WBITS --> expect a gzip header and trailer
+  return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def detect_encoding(head, content_encoding=None):
+  """
+  Determine how a file is compressed, from its declared Content-Encoding or its leading magic bytes.
+
+  :return: GZIP, ZSTD or None (uncompressed)
+  """
+  if content_encoding:
+    encoding = CONTENT_ENCODINGS.get(content_encoding.strip().lower())
+
+    if encoding:
+      return encoding
+
+  if head.startswith(GZIP_MAGIC):
+    return GZIP
+
+  if head.startswith(ZSTD_MAGIC):
+    return ZSTD
+
+  return None
+
+
+def open_stream(fileobj, content_encoding=None):
+  """
+  Get a file-like object yielding the uncompressed contents of fileobj.
+
+  :param fileobj:          (required) file-like object exposing read(size)
+  :param content_encoding: (optional) declared Content-Encoding of fileobj's contents
+
+  :return: fileobj's decompressing reader if it's compressed; otherwise a reader passing its bytes through
+  """
+  head = fileobj.read(len(ZSTD_MAGIC))
+  encoding = detect_encoding(head, content_encoding=content_encoding)
+
+  if encoding:
+    return DecompressingReader(fileobj, encoding, head=head)
+
+  return PrefixedReader(fileobj, head)
+
+
+class PrefixedReader(object):
+  """
+  Read-only file-like object that replays some already-read leading bytes before the rest of a file object.
+  """
+
+  def __init__(self, fileobj, head=b''):
+    self.fileobj = fileobj
+    self.head = head
+
+  def read(self, size=READ_SIZE):
+    if size is None or size < 0:
+      size = READ_SIZE
+
+    if not self.head:
+      return self.fileobj.read(size)
+
+    out, self.head = self.head[:size], self.head[size:]
+
+    if len(out) < size:
+      out += self.fileobj.read(size - len(out))
+
+    return out
@@ -1,69 +1,803 @@
 import os
+import sys
 import json
+import time
 import psycopg2
-from sqlalchemy import create_engine
+from psycopg2 import errorcodes
+from uuid import uuid4
+from Queue import Queue, Full
+from threading import Thread
 from StringIO import StringIO
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from src import logger
+from src.utils.pyredis import redis
+from src.utils import dataset_schema
+from src.helpers import dataset_storage_modes
 
 dataset_db_url = os.environ.get('DATASET_DB_URL')
 
+# Connection pool settings for the dataset DB (shared by the SQLAlchemy engine and raw COPY connections)
+pool_config = {
+  'pool_size': int(os.environ.get('DATASET_DB_POOL_SIZE') or 5),
+  'max_overflow': int(os.environ.get('DATASET_DB_MAX_OVERFLOW') or 10),
+  'pool_recycle': int(os.environ.get('DATASET_DB_POOL_RECYCLE') or 1800),
+  'pool_timeout': int(os.environ.get('DATASET_DB_POOL_TIMEOUT') or 30)
+}
+
 if dataset_db_url:
-  engine = create_engine(dataset_db_url)
+  engine = create_engine(dataset_db_url, **pool_config)
 else:
+  engine = None
   print('DATASET_DB_URL env not set. Not creating SQLAlchemy engine.')
 
+# Max number of bytes handed to COPY FROM STDIN per read
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Number of parallel connections used to COPY a full dataset load (1 disables the parallel loader)
+COPY_WORKERS = int(os.environ.get('DATASET_DB_COPY_WORKERS') or 1)
+
+# Max number of rows per chunk handed to each parallel COPY worker
+PARALLEL_CHUNK_ROWS = 50000
+
+# Max number of (serialized) bytes per chunk handed to each parallel COPY worker, so wide records can't blow up
+# the memory held by the chunk queue
+PARALLEL_CHUNK_BYTES = 8 * 1024 * 1024
+
+# How long the table swap waits for the live table's lock before backing off (so readers aren't queued behind it)
+SWAP_LOCK_TIMEOUT = '5s'
+
+# Number of attempts made at acquiring the live table's lock for a swap
+SWAP_LOCK_ATTEMPTS = 10
+
+# Number of rows fetched per round-trip from a server-side cursor when exporting records
+EXPORT_BATCH_SIZE = 2000
+
+# Table (inside the dataset DB) tracking per-dataset-table metadata, such as record counts
+META_TABLE = 'dataset_tables'
+
+# How long (in seconds) a cached record count lives in redis before being re-read from Postgres
+RECORD_COUNT_CACHE_TTL = 600
+
+meta_table_ensured = False
+
+# Storage mode of each table, by name (a table's storage mode never changes once created)
+storage_modes = {}
+
+
+def pool_metrics():
+  """
+  Get a snapshot of the dataset DB connection pool's usage.
+  """
+  pool = engine.pool
+
+  return {
+    'size': pool.size(),
+    'checked_in': pool.checkedin(),
+    'checked_out': pool.checkedout(),
+    'overflow': pool.overflow(),
+    'max_overflow': pool_config['max_overflow']
+  }
+
+
+if engine:
+  @event.listens_for(engine, 'checkout')
+  def warn_on_saturated_pool(dbapi_conn, conn_record, conn_proxy):
+    metrics = pool_metrics()
+
+    if metrics['checked_out'] >= metrics['size'] + metrics['max_overflow']:
+      logger.warn('Dataset DB connection pool saturated: {}'.format(metrics))
+
+
+@contextmanager
+def raw_connection():
+  """
+  Borrow a raw psycopg2 connection from the dataset DB pool (for COPY and friends).
+
+  Commits if the block succeeds, rolls back if it raises, and always returns the connection to the pool.
+  """
+  conn = engine.raw_connection()
+
+  try:
+    yield conn
+    conn.commit()
+  except:
+    conn.rollback()
+    raise
+  finally:
+    conn.close()
+
+
+class RecordStream(object):
+  """
+  Read-only file-like object that lazily serializes records into COPY text format.
+
+  psycopg2's copy_from pulls from this in bounded chunks, so neither the records nor
+  their serialized form are ever fully materialized in memory.
+  """
+
+  def __init__(self, records, sep='\t', start_id=1, schema=None):
+    self.records = iter(records)
+    self.sep = sep
+    self.schema = schema
+    self.next_id = start_id
+    self.count = 0
+    self.buf = ''
+
+  def format_record(self, record):
+    if self.schema is not None:
+      return dataset_schema.format_row(record, self.schema, self.next_id, sep=self.sep)
+
+    # Backslashes are COPY's escape character, so they must be doubled.
+    return '{}{}{}\n'.format(self.next_id, self.sep, json.dumps(record).replace('\\', '\\\\'))
+
+  def read(self, size=COPY_CHUNK_SIZE):
+    if size is None or size < 0:
+      size = COPY_CHUNK_SIZE
+
+    chunks = [self.buf]
+    length = len(self.buf)
+
+    while length < size:
+      try:
+        record = next(self.records)
+      except StopIteration:
+        break
+
+      line = self.format_record(record)
+      self.next_id += 1
+      self.count += 1
+
+      chunks.append(line)
+      length += len(line)
+
+    data = ''.join(chunks)
+    self.buf = data[size:]
+
+    return data[:size]
+
+  def readline(self, size=None):
+    return self.read(size)
+
+  def read_rows(self, max_rows, max_bytes=None):
+    """
+    Serialize whole records, up to max_rows of them or until they reach max_bytes (a chunk always
+    holds at least one record).
+    """
+    lines = []
+    length = 0
+
+    for record in self.records:
+      line = self.format_record(record)
+      self.next_id += 1
+      self.count += 1
+
+      lines.append(line)
+      length += len(line)
+
+      if len(lines) >= max_rows or (max_bytes is not None and length >= max_bytes):
+        break
+
+    return ''.join(lines)
+
+
+class CopyWorker(Thread):
+  """
+  Thread COPY-ing chunks of rows (pulled off a shared queue) into a table over its own pooled connection.
+  """
+
+  def __init__(self, chunks, table, sep='\t', columns=None, failures=None):
+    super(CopyWorker, self).__init__()
+    self.daemon = True
+    self.chunks = chunks
+    self.table = table
+    self.sep = sep
+    self.columns = columns
+    self.failures = failures
+
+  def run(self):
+    # Whether this worker has taken its end-of-chunks sentinel off the queue
+    done = False
+
+    try:
+      with raw_connection() as conn:
+        cursor = conn.cursor()
+
+        while True:
+          chunk = self.chunks.get()
+
+          # None signals that there are no more chunks
+          if chunk is None:
+            done = True
+            break
+
+          # Once any worker has failed, the load is doomed -- just keep the queue moving
+          if not self.failures:
+            cursor.copy_from(StringIO(chunk), self.table, sep=self.sep, size=COPY_CHUNK_SIZE, columns=self.columns)
+    except BaseException as e:
+      self.failures.append(sys.exc_info())
+      logger.error('Parallel COPY into {} failed: {}'.format(self.table, e))
+
+      # Keep draining so the producer never blocks on a full queue (unless this worker's sentinel was already
+      # taken, e.g. the final commit failed -- draining then would block forever or steal another worker's)
+      while not done and self.chunks.get() is not None:
+        pass
+
+
+def ensure_meta_table():
+  global meta_table_ensured
+
+  if meta_table_ensured:
+    return
+
+  engine.execute('CREATE TABLE IF NOT EXISTS {} (name text PRIMARY KEY NOT NULL, '
+                 'record_count bigint NOT NULL DEFAULT 0);'.format(META_TABLE))
+
+  # Columns added after the meta table was first introduced
+  engine.execute("ALTER TABLE {} ADD COLUMN IF NOT EXISTS storage text NOT NULL DEFAULT '{}';".format(
+    META_TABLE, dataset_storage_modes.JSON))
+
+  engine.execute('ALTER TABLE {} ADD COLUMN IF NOT EXISTS schema json;'.format(META_TABLE))
 
-def create_table(name):
-  engine.execute('CREATE TABLE {} (id serial PRIMARY KEY NOT NULL, data json NOT NULL);'.format(name))
+  meta_table_ensured = True
+
+
+def record_count_cache_key(table):
+  return 'dataset-record-count:{}'.format(table)
+
+
+def cache_record_count(table, count):
+  if redis:
+    redis.setex(record_count_cache_key(table), RECORD_COUNT_CACHE_TTL, count)
+
+
+def save_record_count(cursor, table, count):
+  """
+  Upsert a table's record count. Meant to run inside the same transaction that changed the table.
+  """
+  cursor.execute('INSERT INTO {} (name, record_count) VALUES (%s, %s) '
+                 'ON CONFLICT (name) DO UPDATE SET record_count = EXCLUDED.record_count;'.format(META_TABLE),
+                 (table, count))
+
+
+def create_table(name, schema=None):
+  """
+  Create a dataset table.
+
+  :param name:   (required) name of the table
+  :param schema: (optional) typed schema (see dataset_schema). If provided, the table is created
+                 in typed storage mode; otherwise records are stored in a single json column.
+  """
+  ensure_meta_table()
+
+  if schema is None:
+    storage = dataset_storage_modes.JSON
+    columns = 'data json NOT NULL'
+  else:
+    storage = dataset_storage_modes.TYPED
+    columns = ', '.join([c for c in [dataset_schema.column_definitions(schema), 'extra jsonb'] if c])
+
+  with engine.begin() as conn:
+    conn.execute('CREATE TABLE {} (id serial PRIMARY KEY NOT NULL, {});'.format(name, columns))
+
+    conn.execute('INSERT INTO {} (name, record_count, storage, schema) VALUES (%s, 0, %s, %s) '
+                 'ON CONFLICT (name) DO UPDATE SET record_count = 0, storage = EXCLUDED.storage, '
+                 'schema = EXCLUDED.schema;'.format(META_TABLE),
+                 (name, storage, json.dumps(schema) if schema is not None else None))
+
+  storage_modes[name] = storage
+  cache_record_count(name, 0)
 
 
 def drop_table(name):
-  engine.execute('DROP TABLE {};'.format(name))
+  ensure_meta_table()
+
+  with engine.begin() as conn:
+    conn.execute('DROP TABLE {};'.format(name))
+    conn.execute('DELETE FROM {} WHERE name = %s;'.format(META_TABLE), (name,))
+
+  storage_modes.pop(name, None)
+
+  if redis:
+    redis.delete(record_count_cache_key(name))
+
+
+def populate_records(records, table=None, sep='\t'):
+  """
+  Replace the contents of a dataset table with the provided records.
+
+  The records are loaded into a shadow table which is then renamed into place in one transaction,
+  so readers of the live table never see it empty or half-loaded, and the old rows are dropped
+  along with the old table rather than left behind as dead tuples. Records appended to the live
+  table while the shadow table was loading are carried over (after the loaded records).
 
+  :param records: (required) iterable of JSON-serializable records (consumed lazily)
+  :param table:   (required) name of the dataset table to populate
+  :param sep:     (optional) column separator used for the COPY stream
 
-def populate_records(records, table=None, sep='|'):
-  # Ensure table is empty
-  engine.execute('DELETE FROM {};'.format(table))
+  :return: number of records inserted
+  """
+  ensure_meta_table()
+
+  if COPY_WORKERS > 1:
+    return parallel_populate_records(records, table=table, sep=sep, workers=COPY_WORKERS)
+
+  with raw_connection() as conn:
+    cursor = conn.cursor()
+    schema = stored_schema(cursor, table)
+    live_max_id = max_record_id(cursor, table)
+
+  shadow = create_shadow_table(table)
 
-  # Create a string buffer from all of our records
-  i = 0
-  data = []
-  for r in records:
-    i += 1
-    data.append('{}{}{}'.format(i, sep, json.dumps(r).replace('\\', '\\\\')))
+  try:
+    stream = RecordStream(records, sep=sep, schema=schema)
 
-  buffer = StringIO('\n'.join(data))
+    # Stream the records into the shadow table
+    with raw_connection() as conn:
+      conn.cursor().copy_from(stream, shadow, sep=sep, size=COPY_CHUNK_SIZE, columns=copy_columns(schema))
 
-  # Get psycopg2 connection and cursor
-  conn = psycopg2.connect(os.environ.get('DATASET_DB_URL'))
-  cursor = conn.cursor()
+    count = swap_in_table(shadow, table, count=stream.count, last_id=stream.next_id - 1, live_max_id=live_max_id,
+                          schema=schema)
+  except:
+    engine.execute('DROP TABLE IF EXISTS {};'.format(shadow))
+    raise
 
-  # Bulk insert the records
-  cursor.copy_from(buffer, table, sep=sep)
-  conn.commit()
+  cache_record_count(table, count)
+
+  return stream.count
+
+
+def create_shadow_table(table, unlogged=False):
+  """
+  Create an empty, index-less copy of a dataset table's columns to bulk load into.
+
+  :return: name of the shadow table
+  """
+  shadow = 'stg_{}'.format(uuid4().hex)
+
+  engine.execute('CREATE {}TABLE {} (LIKE {} INCLUDING CONSTRAINTS);'.format(
+    'UNLOGGED ' if unlogged else '', shadow, table))
+
+  return shadow
+
+
+def parallel_populate_records(records, table=None, sep='\t', workers=COPY_WORKERS, chunk_rows=PARALLEL_CHUNK_ROWS,
+                              chunk_bytes=PARALLEL_CHUNK_BYTES):
+  """
+  Replace the contents of a dataset table with the provided records, COPY-ing in parallel.
+
+  Records are split into chunks (of up to chunk_rows rows / chunk_bytes bytes) that a pool of worker threads COPY (each over
+  its own connection) into an unlogged, index-less staging table. The staging table is then indexed,
+  made durable and swapped in for the live table in a single transaction.
+
+  :return: number of records inserted
+  """
+  # Each worker holds one pooled connection, so don't ask for more than the pool can give out
+  workers = max(1, min(workers, pool_config['pool_size'] + pool_config['max_overflow'] - 1))
+
+  with raw_connection() as conn:
+    cursor = conn.cursor()
+    schema = stored_schema(cursor, table)
+    live_max_id = max_record_id(cursor, table)
+
+  staging = create_shadow_table(table, unlogged=True)
+
+  try:
+    stream = RecordStream(records, sep=sep, schema=schema)
+
+    # Bounded queue keeps at most a couple of chunks per worker in memory at once
+    chunks = Queue(maxsize=workers * 2)
+    failures = []
+
+    copy_workers = [CopyWorker(chunks, staging, sep=sep, columns=copy_columns(schema), failures=failures)
+                    for _ in range(workers)]
+
+    for worker in copy_workers:
+      worker.start()
+
+    try:
+      while not failures:
+        chunk = stream.read_rows(chunk_rows, max_bytes=chunk_bytes)
+
+        if not chunk:
+          break
+
+        put_chunk(chunks, chunk, failures)
+    finally:
+      for _ in copy_workers:
+        chunks.put(None)
+
+      for worker in copy_workers:
+        worker.join()
+
+    if failures:
+      exc_type, exc_value, exc_tb = failures[0]
+      raise exc_type, exc_value, exc_tb
+
+    count = swap_in_table(staging, table, count=stream.count, last_id=stream.next_id - 1, unlogged=True,
+                          live_max_id=live_max_id, schema=schema)
+  except:
+    engine.execute('DROP TABLE IF EXISTS {};'.format(staging))
+    raise
+
+  cache_record_count(table, count)
+
+  return stream.count
+
+
+def put_chunk(chunks, chunk, failures):
+  # Don't block forever on a full queue if every worker has died
+  while True:
+    try:
+      chunks.put(chunk, timeout=1)
+      return
+    except Full:
+      if failures:
+        return
+
+
+def swap_in_table(staging, table, count=0, last_id=0, unlogged=False, live_max_id=None, schema=None):
+  """
+  Atomically replace a dataset table with a fully loaded staging (shadow) table, returning its final record count.
+
+  Records appended to the live table since the load started (ids past live_max_id) are copied into the
+  staging table under the swap's lock, and the live table's grants are re-applied to it.
+
+  The staging table is given its primary key (and made durable, if unlogged) before the live table is
+  locked, so the exclusive lock is only held for the catalog-only renames. Lock acquisition uses a short
+  lock_timeout and retries, so a long-running reader delays the swap instead of stalling every other reader
+  queued up behind it.
+  """
+  with raw_connection() as conn:
+    cursor = conn.cursor()
+    cursor.execute('ALTER TABLE {} ADD PRIMARY KEY (id);'.format(staging))
+
+    if unlogged:
+      cursor.execute('ALTER TABLE {} SET LOGGED;'.format(staging))
+
+  attempt = 0
+
+  while True:
+    attempt += 1
+
+    try:
+      with raw_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET LOCAL lock_timeout = '{}';".format(SWAP_LOCK_TIMEOUT))
+        cursor.execute('LOCK TABLE {} IN ACCESS EXCLUSIVE MODE;'.format(table))
+        total_count = rename_into_place(cursor, staging, table, count=count, last_id=last_id,
+                                        live_max_id=live_max_id, schema=schema)
+
+      return total_count
+    except psycopg2.OperationalError as e:
+      if e.pgcode != errorcodes.LOCK_NOT_AVAILABLE or attempt >= SWAP_LOCK_ATTEMPTS:
+        raise
+
+      logger.warn('Timed out waiting to lock {} for swap (attempt {}/{}). Retrying...'.format(
+        table, attempt, SWAP_LOCK_ATTEMPTS))
+
+      time.sleep(attempt)
+
+
+def rename_into_place(cursor, staging, table, count=0, last_id=0, live_max_id=None, schema=None):
+  """
+  Swap staging in for table. Must run in the transaction holding table's ACCESS EXCLUSIVE lock.
+
+  :return: number of records in the swapped in table
+  """
+  # Carry over records appended while staging was loading. The ACCESS EXCLUSIVE lock conflicts with the
+  # appends' SHARE ROW EXCLUSIVE lock, so none can still be in flight (or land before the swap commits).
+  if live_max_id is not None:
+    columns = ', '.join(table_columns(schema)[1:])
+
+    cursor.execute('INSERT INTO {} (id, {}) SELECT %s + ROW_NUMBER() OVER (ORDER BY id), {} FROM {} '
+                   'WHERE id > %s;'.format(staging, columns, columns, table), (last_id, live_max_id))
+
+    last_id += cursor.rowcount
+    count += cursor.rowcount
+
+  copy_grants(cursor, table, staging)
+
+  # Hand the live table's id sequence over to the staging table so it survives the drop
+  cursor.execute("SELECT pg_get_serial_sequence('{}', 'id');".format(table))
+  sequence = cursor.fetchone()[0]
+
+  if sequence:
+    cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id;'.format(sequence, staging))
+    cursor.execute("ALTER TABLE {} ALTER COLUMN id SET DEFAULT nextval('{}');".format(staging, sequence))
+
+  cursor.execute('DROP TABLE {};'.format(table))
+  cursor.execute('ALTER TABLE {} RENAME TO {};'.format(staging, table))
+  cursor.execute('ALTER INDEX {}_pkey RENAME TO {}_pkey;'.format(staging, table))
+
+  if sequence:
+    sync_id_sequence(cursor, table, last_id)
+
+  save_record_count(cursor, table, count)
+
+  return count
+
+
+def copy_grants(cursor, source, target):
+  """
+  Grant the same privileges on target as are granted on source (CREATE TABLE ... LIKE doesn't copy them).
+  """
+  cursor.execute("SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END, "
+                 "a.privilege_type, a.is_grantable FROM pg_class c, aclexplode(c.relacl) a "
+                 "WHERE c.oid = %s::regclass AND a.grantee <> c.relowner;", (source,))
+
+  for grantee, privilege, is_grantable in cursor.fetchall():
+    cursor.execute('GRANT {} ON {} TO {}{};'.format(privilege, target, grantee,
+                                                    ' WITH GRANT OPTION' if is_grantable else ''))
+
+
+def max_record_id(cursor, table):
+  cursor.execute('SELECT COALESCE(MAX(id), 0) FROM {};'.format(table))
+  return cursor.fetchone()[0]
+
+
+def append_records(records, table=None, sep='\t'):
+  """
+  Append records to a dataset table without touching its existing rows.
+
+  New ids continue from the table's current max id.
+
+  :param records: (required) iterable of JSON-serializable records (consumed lazily)
+  :param table:   (required) name of the dataset table to append to
+  :param sep:     (optional) column separator used for the COPY stream
+
+  :return: number of records appended
+  """
+  ensure_meta_table()
+
+  with raw_connection() as conn:
+    cursor = conn.cursor()
+
+    # Serialize concurrent appends to this table (readers aren't blocked) so ids can't collide
+    cursor.execute('LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE;'.format(table))
+
+    max_id = max_record_id(cursor, table)
+
+    # Tables created before record counts were tracked need one real count first
+    prev_count = stored_record_count(cursor, table)
+
+    if prev_count is None:
+      cursor.execute('SELECT COUNT(*) FROM {};'.format(table))
+      prev_count = cursor.fetchone()[0]
+
+    schema = stored_schema(cursor, table)
+    stream = RecordStream(records, sep=sep, start_id=max_id + 1, schema=schema)
+
+    # Stream only the new records into the table
+    cursor.copy_from(stream, table, sep=sep, size=COPY_CHUNK_SIZE, columns=copy_columns(schema))
+    sync_id_sequence(cursor, table, stream.next_id - 1)
+
+    count = prev_count + stream.count
+    save_record_count(cursor, table, count)
+
+  cache_record_count(table, count)
+
+  return stream.count
+
+
+def sync_id_sequence(cursor, table, last_id):
+  """
+  COPY-ing explicit ids doesn't advance the id serial's sequence, so move it to last_id manually.
+  """
+  cursor.execute("SELECT setval(pg_get_serial_sequence('{}', 'id'), GREATEST(%s, 1), %s);".format(table),
+                 (last_id, last_id > 0))
+
+
+def stored_schema(cursor, table):
+  """
+  Get the typed schema of a table (None for json storage tables).
+  """
+  cursor.execute('SELECT schema FROM {} WHERE name = %s;'.format(META_TABLE), (table,))
+  row = cursor.fetchone()
+
+  if not row or row[0] is None:
+    return None
+
+  # psycopg2 decodes json columns itself, but be tolerant of older drivers returning text
+  return json.loads(row[0]) if isinstance(row[0], basestring) else row[0]
+
+
+def copy_columns(schema):
+  if schema is None:
+    return None
+
+  return dataset_schema.copy_columns(schema)
+
+
+def table_columns(schema):
+  """
+  Get the (quoted) columns of a dataset table, starting with id.
+  """
+  return copy_columns(schema) or ['id', 'data']
+
+
+def table_storage_modes(tables):
+  """
+  Get the storage mode of each table, consulting the meta table only for tables not seen before.
+  """
+  unknown = [t for t in tables if t not in storage_modes]
+
+  if unknown:
+    ensure_meta_table()
+
+    for t in unknown:
+      storage_modes[t] = dataset_storage_modes.JSON
+
+    for name, storage in engine.execute('SELECT name, storage FROM {} WHERE name = ANY(%s);'.format(META_TABLE),
+                                        (unknown,)):
+      storage_modes[name] = storage
+
+  return {t: storage_modes[t] for t in tables}
+
+
+def record_expression(table):
+  """
+  SQL expression selecting a table row's original record as json (the table must be aliased as 't').
+  """
+  if table_storage_modes([table])[table] == dataset_storage_modes.TYPED:
+    return dataset_schema.row_expression('t')
+
+  return 't.data'
+
+
+def stored_record_count(cursor, table):
+  cursor.execute('SELECT record_count FROM {} WHERE name = %s;'.format(META_TABLE), (table,))
+  row = cursor.fetchone()
+
+  if not row:
+    return None
+
+  return int(row[0])
 
 
 def record_count(table=None):
-  result = [r for r in engine.execute('SELECT COUNT(*) FROM {};'.format(table))]
+  """
+  Get the number of records in a dataset table.
+
+  Reads the counter maintained by the ingest/append paths: from redis if cached, otherwise
+  from the dataset DB's meta table. Only tables that predate the counter fall back to COUNT(*).
+  """
+  if redis:
+    cached = redis.get(record_count_cache_key(table))
+
+    if cached is not None:
+      return int(cached)
+
+  ensure_meta_table()
+
+  result = [r for r in engine.execute('SELECT record_count FROM {} WHERE name = %s;'.format(META_TABLE), (table,))]
+
+  if result:
+    count = int(result[0][0])
+  else:
+    result = [r for r in engine.execute('SELECT COUNT(*) FROM {};'.format(table))]
+    count = int(result[0][0]) if result and result[0] else 0
 
-  if not result or not result[0]:
-    return 0
+    engine.execute('INSERT INTO {} (name, record_count) VALUES (%s, %s) '
+                   'ON CONFLICT (name) DO NOTHING;'.format(META_TABLE), (table, count))
 
-  return int(result[0][0])
+  cache_record_count(table, count)
+
+  return count
 
 
 def sample(table=None, limit=1):
   """
   Get 'count' number of records from a table for preview purposes.
   """
-  num_records = record_count(table)
+  query = 'SELECT {} FROM {} t ORDER BY t.id LIMIT {};'.format(record_expression(table), table, int(limit))
+  result = [r for r in engine.execute(query)]
 
-  # If no records in table, return empty list
-  if not num_records:
+  if not result:
     return []
 
-  result = [r for r in engine.execute('SELECT data FROM {} LIMIT {};'.format(table, limit))]
+  return [r[0] for r in result]
+
+
+def summaries(tables, preview_limit=5):
+  """
+  Get the record count and a preview of records for many dataset tables at once.
+
+  Counts come from one redis MGET; previews (plus any counts missing from redis) come from a
+  single UNION ALL query, rather than a count and a sample query per table.
+
+  :param tables:        (required) list of dataset table names
+  :param preview_limit: (optional) max number of preview records per table
+
+  :return: dict mapping table name --> {'num_records': int, 'preview': list}
+  """
+  tables = list(tables)
+
+  if not tables:
+    return {}
+
+  resp = {t: {'num_records': None, 'preview': []} for t in tables}
+
+  if redis:
+    for table, cached in zip(tables, redis.mget([record_count_cache_key(t) for t in tables])):
+      if cached is not None:
+        resp[table]['num_records'] = int(cached)
+
+  uncached = [t for t in tables if resp[t]['num_records'] is None]
+
+  queries = []
+  params = []
+
+  if uncached:
+    ensure_meta_table()
+    queries.append('(SELECT name, record_count, NULL::json AS data FROM {} WHERE name = ANY(%s))'.format(META_TABLE))
+    params.append(uncached)
+
+  table_storage_modes(tables)
+
+  for table in tables:
+    queries.append('(SELECT %s::text, NULL::bigint, {} FROM {} t ORDER BY t.id LIMIT {})'.format(
+      record_expression(table), table, int(preview_limit)))
+
+    params.append(table)
+
+  for name, count, data in engine.execute(' UNION ALL '.join(queries) + ';', tuple(params)):
+    if count is None:
+      resp[name]['preview'].append(data)
+    else:
+      resp[name]['num_records'] = int(count)
+
+  for table in uncached:
+    count = resp[table]['num_records']
+
+    if count is None:
+      # Table predates the record counter
+      resp[table]['num_records'] = record_count(table)
+    else:
+      cache_record_count(table, count)
+
+  return resp
+
+
+def export_records(table=None, after_id=0, limit=None, batch_size=EXPORT_BATCH_SIZE):
+  """
+  Stream records out of a dataset table as NDJSON, paginated by id (keyset pagination).
+
+  Rows are pulled through a server-side (named) cursor, batch_size at a time, so memory
+  stays constant no matter how many rows are exported. Each line looks like:
+
+    {"id": <id>, "data": <record>}
+
+  :param table:      (required) name of the dataset table
+  :param after_id:   (optional) only export records with an id greater than this
+  :param limit:      (optional) max number of records to export
+  :param batch_size: (optional) number of rows fetched (and yielded as one chunk) at a time
+
+  :return: generator of UTF-8 encoded NDJSON chunks
+  """
+  query = 'SELECT t.id, ({})::text FROM {} t WHERE t.id > %s ORDER BY t.id'.format(record_expression(table), table)
+  params = [after_id]
+
+  if limit is not None:
+    query += ' LIMIT %s'
+    params.append(limit)
+
+  with raw_connection() as conn:
+    cursor = conn.cursor(name='export_{}'.format(uuid4().hex))
+    cursor.itersize = batch_size
+    cursor.execute(query, params)
+
+    while True:
+      rows = cursor.fetchmany(batch_size)
+
+      if not rows:
+        break
+
+      # Build each chunk as unicode (records can hold non-ASCII text) and encode it once
+      yield u''.join(u'{{"id": {}, "data": {}}}\n'.format(row_id, to_unicode(data)) for row_id, data in rows).encode('utf-8')
+
+    cursor.close()
 
-  if not result:
-    return []
 
-  return [r[0] for r in result]
\ No newline at end of file
+def to_unicode(text):
+  return text if isinstance(text, unicode) else text.decode('utf-8')
@@ -0,0 +1,206 @@
+"""
+Schema inference and row serialization for typed dataset tables.
+
+A typed dataset table has one real Postgres column per consistently-typed top-level field,
+plus an 'extra' jsonb column holding everything else (nested values, fields with mixed
+types, values that don't fit their column, explicit nulls, etc.).
+
+A schema is a list of [field, pg_type] pairs, in column order.
+"""
+import json
+import math
+
+# Number of leading records inspected to infer a typed schema
+SAMPLE_SIZE = 1000
+
+# Upper bound on typed columns (Postgres caps a table at 1600)
+MAX_COLUMNS = 250
+
+# Column names reserved by the table layout itself
+RESERVED_COLUMNS = ('id', 'extra')
+
+# Postgres limits identifiers to 63 bytes
+MAX_COLUMN_NAME_LENGTH = 63
+
+# Characters that can't go in a column name ('%' would be taken for a psycopg2 placeholder, NUL isn't allowed)
+INVALID_COLUMN_CHARS = ('%', '\x00')
+
+BOOLEAN = 'boolean'
+BIGINT = 'bigint'
+DOUBLE = 'double precision'
+NUMERIC = 'numeric'
+TEXT = 'text'
+
+BIGINT_MIN = -2 ** 63
+BIGINT_MAX = 2 ** 63 - 1
+
+NULL = '\\N'
+
+
+def value_kind(value):
+  if isinstance(value, bool):
+    return BOOLEAN
+
+  if isinstance(value, (int, long)):
+    return BIGINT if BIGINT_MIN <= value <= BIGINT_MAX else None
+
+  if isinstance(value, float):
+    return DOUBLE
+
+  if isinstance(value, basestring):
+    return TEXT
+
+  return None
+
+
+def infer_schema(records):
+  """
+  Infer typed columns from a sample of records.
+
+  :param records: (required) list of sample records (must all be dicts)
+
+  :return: schema --> list of [field, pg_type] pairs
+  """
+  kinds = {}
+  order = []
+
+  for record in records:
+    if not isinstance(record, dict):
+      raise ValueError('Typed storage requires every record to be a JSON object')
+
+    for field, value in record.items():
+      if value is None:
+        continue
+
+      if field not in kinds:
+        kinds[field] = set()
+        order.append(field)
+
+      kinds[field].add(value_kind(value))
+
+  schema = []
+
+  for field in order:
+    if not valid_column_name(field):
+      continue
+
+    field_kinds = kinds[field]
+
+    # Float columns (including ints mixed with floats) are stored as numeric rather than double, since numeric
+    # keeps each value as written (3 stays 3, 3.0 stays 3.0) when records are rebuilt
+    if field_kinds in ({DOUBLE}, {BIGINT, DOUBLE}):
+      field_kinds = {NUMERIC}
+
+    if len(field_kinds) != 1 or None in field_kinds:
+      continue
+
+    schema.append([field, field_kinds.pop()])
+
+    if len(schema) >= MAX_COLUMNS:
+      break
+
+  return schema
+
+
+def valid_column_name(field):
+  """
+  Whether a field can get a typed column of its own (if not, its values are kept in the extra column).
+  """
+  if not field or field in RESERVED_COLUMNS or len(field.encode('utf-8')) > MAX_COLUMN_NAME_LENGTH:
+    return False
+
+  return not any(c in field for c in INVALID_COLUMN_CHARS)
+
+
+def quote_ident(name):
+  return '"{}"'.format(name.replace('"', '""'))
+
+
+def column_definitions(schema):
+  return ', '.join('{} {}'.format(quote_ident(field).encode('utf-8'), pg_type) for field, pg_type in schema)
+
+
+def copy_columns(schema):
+  return ['id'] + [quote_ident(field).encode('utf-8') for field, pg_type in schema] + ['extra']
+
+
+def strip_nul(value):
+  """
+  Remove NUL characters from a value's strings (including dict keys), which neither text nor jsonb can hold.
+  """
+  if isinstance(value, basestring):
+    return value.replace(u'\x00', u'') if isinstance(value, unicode) else value.replace('\x00', '')
+
+  if isinstance(value, dict):
+    return {strip_nul(k): strip_nul(v) for k, v in value.items()}
+
+  if isinstance(value, list):
+    return [strip_nul(v) for v in value]
+
+  return value
+
+
+def copy_escape(text):
+  if isinstance(text, unicode):
+    text = text.encode('utf-8')
+
+  return text.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+
+
+def format_value(value, pg_type):
+  """
+  Serialize a value for its typed column in COPY text format. Returns None if it doesn't fit the column.
+  """
+  kind = value_kind(value)
+
+  if pg_type == NUMERIC and kind in (BIGINT, DOUBLE):
+    # Non-finite floats aren't valid JSON numbers anyway -- leave them to the extra column
+    if kind == DOUBLE and (math.isinf(value) or math.isnan(value)):
+      return None
+
+    return str(value) if kind == BIGINT else repr(value)
+
+  if kind != pg_type:
+    return None
+
+  if pg_type == BOOLEAN:
+    return 't' if value else 'f'
+
+  if pg_type == BIGINT:
+    return str(value)
+
+  return copy_escape(strip_nul(value))
+
+
+def format_row(record, schema, row_id, sep='\t'):
+  """
+  Serialize a record into a line of COPY text for a typed table with the given schema.
+  """
+  if not isinstance(record, dict):
+    raise ValueError('Typed storage requires every record to be a JSON object')
+
+  extra = dict(record)
+  values = [str(row_id)]
+
+  for field, pg_type in schema:
+    formatted = None
+
+    if field in extra and extra[field] is not None:
+      formatted = format_value(extra[field], pg_type)
+
+    if formatted is None:
+      values.append(NULL)
+    else:
+      values.append(formatted)
+      extra.pop(field)
+
+  values.append(copy_escape(json.dumps(strip_nul(extra))) if extra else NULL)
+
+  return sep.join(values) + '\n'
+
+
+def row_expression(alias='t'):
+  """
+  SQL expression rebuilding the original record (as json) from a row of a typed table.
+  """
+  return "(jsonb_strip_nulls(to_jsonb({0}) - 'id' - 'extra') || COALESCE({0}.extra, '{{}}'::jsonb))::json".format(alias)
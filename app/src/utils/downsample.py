@@ -0,0 +1,105 @@
+"""
+Downsampling of graph series, so long training runs don't send (and draw) every data point.
+
+Supported methods:
+
+  lttb    -- Largest-Triangle-Three-Buckets: keeps the point of each bucket forming the largest triangle
+             with its neighbors' picks, preserving the series' visual shape.
+  min_max -- keeps each bucket's min and max points, preserving spikes.
+
+Both are computed over NumPy arrays of the series' x/y values.
+"""
+import numpy as np
+
+LTTB = 'lttb'
+MIN_MAX = 'min_max'
+
+# Fewest points a series is downsampled to (its first, last and at least one in between)
+MIN_POINTS = 3
+
+
+def lttb(x, y, max_points):
+  """
+  Pick max_points indices of an x-sorted series with Largest-Triangle-Three-Buckets.
+
+  :return: sorted array of indices to keep
+  """
+  n = len(x)
+
+  if n <= max_points:
+    return np.arange(n)
+
+  # The first and last points are always kept, with the rest split into max_points - 2 buckets
+  edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+  counts = np.diff(edges)
+
+  # Each bucket's average point (the third vertex of the previous bucket's triangles)
+  avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+  avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+
+  next_x = np.append(avg_x[1:], x[-1])
+  next_y = np.append(avg_y[1:], y[-1])
+
+  selected = np.empty(max_points, dtype=np.int64)
+  selected[0] = 0
+  selected[-1] = n - 1
+
+  a = 0
+
+  for i in range(max_points - 2):
+    start, end = edges[i], edges[i + 1]
+
+    # Twice the area of each candidate's triangle with the last pick and the next bucket's average
+    areas = np.abs((x[a] - next_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y[i] - y[a]))
+
+    a = start + int(np.argmax(areas))
+    selected[i + 1] = a
+
+  return selected
+
+
+def min_max(x, y, max_points):
+  """
+  Pick (up to) max_points indices of an x-sorted series, keeping the min and max y points of each bucket.
+
+  :return: sorted array of indices to keep
+  """
+  n = len(x)
+
+  if n <= max_points:
+    return np.arange(n)
+
+  num_buckets = max_points // 2
+  buckets = np.arange(n) * num_buckets // n
+
+  # Order points by bucket, then y --> the first and last point of each bucket are its min and max
+  order = np.lexsort((y, buckets))
+  starts = np.searchsorted(buckets[order], np.arange(num_buckets))
+  ends = np.append(starts[1:], n)
+
+  return np.unique(np.concatenate((order[starts], order[ends - 1])))
+
+
+METHODS = {
+  LTTB: lttb,
+  MIN_MAX: min_max
+}
+
+
+def downsample(x, y, max_points=None, method=LTTB):
+  """
+  Downsample an x-sorted series if it has more than max_points.
+
+  :param x:          (required) array of the series' x values (sorted)
+  :param y:          (required) array of the series' y values
+  :param max_points: (optional) max number of points to keep (all of them if None)
+  :param method:     (optional) downsampling method (lttb or min_max)
+
+  :return: tuple --> (x, y) arrays of the points kept
+  """
+  if not max_points or len(x) <= max_points:
+    return x, y
+
+  keep = METHODS.get(method, lttb)(x, y, max(max_points, MIN_POINTS))
+
+  return x[keep], y[keep]
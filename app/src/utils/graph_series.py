@@ -0,0 +1,39 @@
+"""
+Packed storage of graph series.
+
+A GraphDataGroup's points are stored in GraphDataChunks of up to CHUNK_SIZE points each, with the
+chunk's x and y values packed into byte buffers of little-endian float64s.
+
+Each chunk's points are sorted by x, and a group's chunks cover non-overlapping x ranges
+([x_min, x_max]), so reading the chunks by x_min yields the whole series in x order.
+"""
+import numpy as np
+
+# Max number of points per chunk
+CHUNK_SIZE = 1000
+
+# How values are packed (little-endian float64)
+DTYPE = np.dtype('<f8')
+
+
+def pack(values):
+  return np.asarray(values, dtype=DTYPE).tobytes()
+
+
+def unpack(buf):
+  return np.frombuffer(bytes(buf or b''), dtype=DTYPE)
+
+
+def read_chunks(chunks):
+  """
+  Decode a series' chunks (ordered by x_min) into its x and y values.
+
+  :return: tuple --> (x, y) float64 arrays, sorted by x
+  """
+  if not chunks:
+    return np.empty(0, dtype=DTYPE), np.empty(0, dtype=DTYPE)
+
+  x = np.concatenate([unpack(c.x_data) for c in chunks])
+  y = np.concatenate([unpack(c.y_data) for c in chunks])
+
+  return x, y
@@ -0,0 +1,160 @@
+"""
+Incremental parsing of large JSON documents from file objects.
+
+Only a bounded window of the underlying file is ever held in memory, so multi-GB
+uploads can be consumed one element at a time instead of being json.loads-ed whole.
+
+Usage:
+
+  for record in json_stream.iter_array(fileobj):
+    ...
+
+"""
+import json
+import codecs
+
+# Default number of bytes to read from the file object at a time
+READ_SIZE = 64 * 1024
+
+# Max size (in characters) of a single array element. Malformed input can't be told apart from an
+# incomplete element, so this caps how much of the file is buffered before giving up on one.
+MAX_VALUE_SIZE = 64 * 1024 * 1024
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]'
+
+
+class ArrayReader(object):
+  """
+  Reads the elements of a top-level JSON array from a file object, one at a time.
+  """
+
+  def __init__(self, fileobj, read_size=READ_SIZE, max_value_size=MAX_VALUE_SIZE):
+    self.fileobj = fileobj
+    self.read_size = read_size
+    self.max_value_size = max_value_size
+    self.decoder = json.JSONDecoder()
+    self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+    self.buf = u''
+    self.pos = 0
+    self.eof = False
+
+  def fill(self, size=None):
+    """
+    Read more text into the buffer, discarding whatever has already been consumed.
+
+    :return: (boolean) whether any new text was read
+    """
+    if self.eof:
+      return False
+
+    chunk = self.fileobj.read(size or self.read_size)
+
+    if not chunk:
+      self.eof = True
+      self.buf = self.buf[self.pos:] + self.text_decoder.decode(b'', final=True)
+      self.pos = 0
+      return False
+
+    if not isinstance(chunk, unicode):
+      chunk = self.text_decoder.decode(chunk)
+
+    self.buf = self.buf[self.pos:] + chunk
+    self.pos = 0
+    return True
+
+  def next_char(self):
+    """
+    Skip whitespace and return the next significant character (without consuming it).
+    """
+    while True:
+      while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+        self.pos += 1
+
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+
+      if not self.fill():
+        return None
+
+  def decode_value(self):
+    """
+    Decode the next JSON value from the buffer, reading more of the file as needed.
+    """
+    read_size = self.read_size
+    self.next_char()
+
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buf, self.pos)
+      except ValueError:
+        # Value is incomplete (or malformed) -- read more (in growing increments to stay linear for huge elements)
+        self.check_value_size()
+
+        if not self.fill(read_size):
+          raise ValueError('Unexpected end of JSON input')
+
+        read_size *= 2
+        continue
+
+      # A number not yet followed by a delimiter may have been cut off mid-way
+      if self.is_number(value) and not self.eof and \
+        (end == len(self.buf) or self.buf[end] not in DELIMITERS):
+        self.check_value_size()
+        self.fill(read_size)
+        read_size *= 2
+        continue
+
+      self.pos = end
+      return value
+
+  def check_value_size(self):
+    if len(self.buf) - self.pos > self.max_value_size:
+      raise ValueError('Invalid JSON array element (or element larger than {} characters)'.format(self.max_value_size))
+
+  @staticmethod
+  def is_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+  def __iter__(self):
+    if self.next_char() != '[':
+      raise ValueError('Data is not a JSON array')
+
+    self.pos += 1
+
+    if self.next_char() == ']':
+      self.pos += 1
+      return
+
+    while True:
+      yield self.decode_value()
+
+      char = self.next_char()
+      self.pos += 1
+
+      if char == ']':
+        return
+
+      if char != ',':
+        raise ValueError('Expecting , or ] between JSON array elements, got: {}'.format(char))
+
+
+def iter_array(fileobj, read_size=READ_SIZE, max_value_size=MAX_VALUE_SIZE):
+  """
+  Lazily iterate over the elements of a JSON array contained in a file object.
+
+  The opening bracket is validated eagerly, so a non-array upload fails before any
+  work is done with it.
+
+  :param fileobj:        (required) file-like object exposing read(size)
+  :param read_size:      (optional) number of bytes to read from fileobj at a time
+  :param max_value_size: (optional) max size (in characters) of a single element
+
+  :return: generator of decoded array elements
+  """
+  reader = ArrayReader(fileobj, read_size=read_size, max_value_size=max_value_size)
+
+  if reader.next_char() != '[':
+    raise ValueError('Data is not a JSON array')
+
+  return iter(reader)
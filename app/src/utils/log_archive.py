@@ -0,0 +1,73 @@
+"""
+Cold storage of deployment log streams.
+
+Once a deployment finishes, its redis log streams are archived (zlib-compressed JSON) into the
+LogArchive table and given a TTL, so redis only holds the logs of active (and recently finished)
+deployments. Readers use read_stream/read_streams, which fall back to the archive once a hot
+stream is gone.
+"""
+import json
+import zlib
+from src import dbi
+from src.models import LogArchive
+from src.utils.pyredis import redis
+
+# How long (s) a finished deployment's streams stay in redis after being archived
+STREAM_TTL = 24 * 60 * 60
+
+
+def deployment_stream_keys(deployment):
+  return [
+    deployment.train_deploy_log(),
+    deployment.train_log(),
+    deployment.done_training_log(),
+    deployment.api_deploy_log()
+  ]
+
+
+def compress_entries(entries):
+  return zlib.compress(json.dumps([[entry_id, data] for entry_id, data in entries]))
+
+
+def decompress_entries(blob):
+  if not blob:
+    return []
+
+  return [(entry_id, data) for entry_id, data in json.loads(zlib.decompress(blob))]
+
+
+def read_archived(stream_keys):
+  """
+  Get the archived entries of the given streams.
+
+  :return: dict of stream_key --> list of (entry_id, data) tuples (only for archived streams)
+  """
+  if not stream_keys:
+    return {}
+
+  archives = dbi.find_all(LogArchive, {'stream_key': list(stream_keys)})
+
+  return {archive.stream_key: decompress_entries(archive.entries) for archive in archives}
+
+
+def read_streams(stream_keys):
+  """
+  Read the full contents of the given log streams, from redis or (once expired there) the archive.
+
+  :return: dict of stream_key --> list of (entry_id, data) tuples
+  """
+  pipe = redis.pipeline()
+
+  for key in stream_keys:
+    pipe.xrange(key)
+
+  streams = dict(zip(stream_keys, pipe.execute()))
+
+  missing = [key for key in stream_keys if not streams[key]]
+  streams.update(read_archived(missing))
+
+  return streams
+
+
+def read_stream(stream_key):
+  return read_streams([stream_key])[stream_key]
@@ -0,0 +1,207 @@
+"""
+Per-process hub multiplexing redis log stream tails.
+
+Rather than every connected client running its own blocking XREAD, a single background thread
+reads every subscribed stream key with one XREAD and fans new entries out to each subscriber
+through an in-process queue.
+
+Usage:
+
+  sub = log_hub.subscribe([stream_key])
+
+  try:
+    entries = sub.get(timeout=30)  # list of (stream_key, entry_id, data) tuples
+  finally:
+    sub.close()
+
+"""
+from time import sleep
+from Queue import Queue, Empty, Full
+from threading import Thread, Lock, Event
+from pyredis import redis
+from src import logger
+
+# How long (ms) the hub's XREAD blocks before re-checking its set of subscribed keys
+HUB_BLOCK = 1000
+
+# Max number of entries returned per stream by one of the hub's XREADs
+HUB_READ_COUNT = 500
+
+# Max number of entries buffered per subscriber before its oldest ones are dropped (its reader resyncs from the streams)
+SUBSCRIBER_QUEUE_SIZE = 5000
+
+
+def parse_id(entry_id):
+  """
+  Convert a stream entry id ('<ms>-<seq>') into a tuple that compares in stream order.
+  """
+  ms, _, seq = str(entry_id).partition('-')
+  return int(ms), int(seq or 0)
+
+
+def next_id(entry_id):
+  """
+  Get the smallest possible stream entry id after entry_id (XRANGE's start is inclusive).
+  """
+  ms, seq = parse_id(entry_id)
+  return '{}-{}'.format(ms, seq + 1)
+
+
+def latest_id(stream_key):
+  """
+  Get the id of the newest entry in a stream ('0-0' if the stream doesn't exist yet).
+  """
+  result = redis.execute_command('XREVRANGE', stream_key, '+', '-', 'COUNT', 1)
+
+  if not result:
+    return '0-0'
+
+  return result[0][0]
+
+
+class Subscription(object):
+
+  def __init__(self, hub, keys, queue_size=SUBSCRIBER_QUEUE_SIZE):
+    self.hub = hub
+    self.keys = keys
+    self.queue = Queue(maxsize=queue_size)
+    self.dropped = 0
+
+  def put(self, entry):
+    # Never block the hub on a slow consumer -- drop its oldest entry instead
+    while True:
+      try:
+        self.queue.put_nowait(entry)
+        return
+      except Full:
+        try:
+          self.queue.get_nowait()
+          self.dropped += 1
+        except Empty:
+          pass
+
+  def get(self, timeout=None, max_entries=None):
+    """
+    Wait up to timeout seconds for new entries, then return (up to max_entries of) everything that's queued up.
+
+    :return: list of (stream_key, entry_id, data) tuples (empty if timed out)
+    """
+    try:
+      entries = [self.queue.get(timeout=timeout)]
+    except Empty:
+      return []
+
+    while max_entries is None or len(entries) < max_entries:
+      try:
+        entries.append(self.queue.get_nowait())
+      except Empty:
+        break
+
+    return entries
+
+  def pop_dropped(self):
+    dropped, self.dropped = self.dropped, 0
+    return dropped
+
+  def close(self):
+    self.hub.unsubscribe(self)
+
+
+class LogHub(Thread):
+
+  def __init__(self, block=HUB_BLOCK):
+    super(LogHub, self).__init__()
+    self.daemon = True
+    self.block = block
+    self.lock = Lock()
+    self.has_subscribers = Event()
+    self.subscribers = {}  # stream_key --> set of subscriptions
+    self.cursors = {}  # stream_key --> id of the last entry read
+
+  def subscribe(self, keys, queue_size=SUBSCRIBER_QUEUE_SIZE):
+    """
+    Subscribe to new entries of the given stream keys.
+
+    Only entries added after this call are delivered, so callers wanting history should
+    read it (e.g. with XRANGE) after subscribing and skip duplicates by entry id.
+    """
+    sub = Subscription(self, keys, queue_size=queue_size)
+
+    with self.lock:
+      for key in keys:
+        if key not in self.cursors:
+          self.cursors[key] = latest_id(key)
+
+        self.subscribers.setdefault(key, set()).add(sub)
+
+      self.has_subscribers.set()
+
+    return sub
+
+  def unsubscribe(self, sub):
+    with self.lock:
+      for key in sub.keys:
+        subs = self.subscribers.get(key)
+
+        if subs is None:
+          continue
+
+        subs.discard(sub)
+
+        # Stop tailing streams nobody is listening to anymore
+        if not subs:
+          self.subscribers.pop(key)
+          self.cursors.pop(key, None)
+
+      if not self.subscribers:
+        self.has_subscribers.clear()
+
+  def run(self):
+    while True:
+      self.has_subscribers.wait()
+
+      with self.lock:
+        cursors = dict(self.cursors)
+
+      if not cursors:
+        continue
+
+      try:
+        result = redis.xread(count=HUB_READ_COUNT, block=self.block, **cursors)
+      except BaseException as e:
+        logger.error('Log hub XREAD failed: {}'.format(e))
+        sleep(1)
+        continue
+
+      if not result:
+        continue
+
+      with self.lock:
+        for key, items in result.items():
+          if not items or key not in self.cursors:
+            continue
+
+          self.cursors[key] = items[-1][0]
+          subs = list(self.subscribers.get(key) or [])
+
+          for entry_id, data in items:
+            for sub in subs:
+              sub.put((key, entry_id, data))
+
+
+hub = None
+hub_lock = Lock()
+
+
+def subscribe(keys):
+  """
+  Subscribe to the given stream keys through this process' hub (started on first use).
+  """
+  global hub
+
+  with hub_lock:
+    if hub is None:
+      hub = LogHub()
+      hub.start()
+
+  return hub.subscribe(keys)
@@ -0,0 +1,145 @@
+"""
+Per-stage index of deployment log streams.
+
+Deploy log streams (train-deploy:<uid>, api-deploy:<uid>) hold the logs of several stages. Rather
+than scanning a whole stream to pick out one stage's entries, each stream has an index hash
+(<stream_key>:stages) holding the ids of every stage's first and last entries, so a stage's logs
+come from a targeted XRANGE.
+
+The index is maintained by its readers rather than by Logger, since the build server writes to
+these streams directly. Its _cursor field holds the id of the last entry indexed, so catching the
+index up only reads the entries added since.
+"""
+import log_archive
+from log_hub import next_id
+from pyredis import redis
+
+# Index field holding the id of the last stream entry indexed
+CURSOR = '_cursor'
+
+
+def index_key(stream_key):
+  return '{}:stages'.format(stream_key)
+
+
+def first_field(stage):
+  return '{}:first'.format(stage)
+
+
+def last_field(stage):
+  return '{}:last'.format(stage)
+
+
+def index_updates(index, entries):
+  """
+  Get the index fields that change once the given (newly added) stream entries are indexed.
+  """
+  updates = {}
+
+  for entry_id, data in entries:
+    stage = data.get('stage')
+
+    if not stage:
+      continue
+
+    if first_field(stage) not in index and first_field(stage) not in updates:
+      updates[first_field(stage)] = entry_id
+
+    updates[last_field(stage)] = entry_id
+
+  if entries:
+    updates[CURSOR] = entries[-1][0]
+
+  return updates
+
+
+def read_stage_logs(stream_stages, cursors=None):
+  """
+  Read the logs of specific stages from deploy log streams, catching each stream's index up first.
+
+  :param stream_stages: (required) dict of stream_key --> list of stages to read from it
+  :param cursors:       (optional) dict to fill with the id of the last entry each stream was read up to
+                        (every entry of the stages up to it is returned, and none after it)
+
+  :return: dict of stage --> list of (entry_id, data) tuples
+  """
+  stream_keys = list(stream_stages)
+
+  pipe = redis.pipeline()
+
+  for key in stream_keys:
+    pipe.hgetall(index_key(key))
+
+  indexes = dict(zip(stream_keys, pipe.execute()))
+
+  # Read whatever's been added to each stream since its index was last updated
+  pipe = redis.pipeline()
+
+  for key in stream_keys:
+    cursor = indexes[key].get(CURSOR)
+    pipe.execute_command('XRANGE', key, next_id(cursor) if cursor else '-', '+')
+    pipe.pttl(key)
+
+  results = pipe.execute()
+  new_entries = dict(zip(stream_keys, results[0::2]))
+  ttls = dict(zip(stream_keys, results[1::2]))
+
+  # PTTL is -2 for keys that don't exist
+  exists = {key: ttls[key] != -2 for key in stream_keys}
+
+  # Streams that aren't in redis anymore are read from their archives instead
+  archived = log_archive.read_archived([key for key in stream_keys if not exists[key]])
+
+  pipe = redis.pipeline()
+  num_commands = 0
+  reads = []  # (stage, position of its XRANGE in the pipeline)
+
+  for key in stream_keys:
+    if not exists[key]:
+      continue
+
+    index = indexes[key]
+    updates = index_updates(index, new_entries[key])
+
+    if updates:
+      pipe.hmset(index_key(key), updates)
+      num_commands += 1
+      index.update(updates)
+
+      # Expire the index along with its stream
+      if ttls[key] > 0:
+        pipe.pexpire(index_key(key), ttls[key])
+        num_commands += 1
+
+    # Stage ranges end at their last indexed entry, so nothing past the index's cursor is read
+    if cursors is not None and index.get(CURSOR):
+      cursors[key] = index[CURSOR]
+
+    for stage in stream_stages[key]:
+      first = index.get(first_field(stage))
+
+      if not first:
+        continue
+
+      pipe.execute_command('XRANGE', key, first, index[last_field(stage)])
+      reads.append((stage, num_commands))
+      num_commands += 1
+
+  results = pipe.execute()
+
+  stage_logs = {stage: [] for stages in stream_stages.values() for stage in stages}
+
+  # Stages can interleave within their range (e.g. retries), so still filter on each entry's stage
+  for stage, position in reads:
+    stage_logs[stage] = [(entry_id, data) for entry_id, data in results[position]
+                         if data.get('stage') == stage]
+
+  for key, entries in archived.items():
+    if cursors is not None and entries:
+      cursors[key] = entries[-1][0]
+
+    for entry_id, data in entries:
+      if data.get('stage') in stream_stages[key]:
+        stage_logs[data['stage']].append((entry_id, data))
+
+  return stage_logs
@@ -1,145 +1,382 @@
+import json
 import log_formatter
-from src import logger, dbi
+import log_hub
+import log_archive
+from uuid import uuid4
+from threading import Lock
+from collections import OrderedDict, deque
+from src import logger, dbi, db
+from src.models import Deployment
 from pyredis import redis
-from src.helpers.definitions import tci_keep_alive
+from src.helpers import ms_since_epoch
+from src.helpers.definitions import tci_keep_alive, tci_resume_token
 
-# TODO: This file is disgusting -- make it less disgusting
+# Max number of log entries formatted and flushed together as one HTTP chunk
+BATCH_SIZE = 500
 
+# Kinds of log streams that can be opened (and handed off to the log stream server)
+DEPLOY_LOGS = 'deploy'
+TRAIN_LOGS = 'train'
+ALL_LOGS = 'all'
 
-def should_complete_stream(data, deployment):
+# How long (s) a log stream handoff token can be redeemed for
+HANDOFF_TOKEN_TTL = 60
+
+# Tail latency (ms) past which a log stream is considered to be falling behind
+SLOW_TAIL_LATENCY = 5000
+
+# Number of most recent entries per stream that its tail latency is measured over
+LATENCY_WINDOW = 100
+
+# Max number of streams whose tail latency is tracked (least recently tailed ones are forgotten first)
+MAX_LATENCY_STREAMS = 1000
+
+# stream_key --> latencies (ms) of its most recently tailed entries (for this process)
+latency_windows = OrderedDict()
+latency_lock = Lock()
+
+
+def should_complete_stream(data, deployment_uid):
   # Check if last_entry was specified in the log. Complete the stream if so.
   complete = data.get('last_entry') == 'True'
 
   # Check to see if this was an error log. Complete the stream if so.
   if data.get('level') == 'error':
     # Fail the deployment and log that this happened internally
-    logger.error('DEPLOYMENT FAILED: uid={}'.format(deployment.uid))
-    deployment.fail()
+    logger.error('DEPLOYMENT FAILED: uid={}'.format(deployment_uid))
+    fail_deployment(deployment_uid)
     complete = True
 
   return complete
 
 
-def stream_deploy_logs(deployment, stream_key=None, block=30000):
-  complete = False
-  first_log = redis.xrange(stream_key, count=1)
-  
-  # If logs already exist, yield the first one and then
-  # iterate over timestamps to continue yielding
-  if first_log:
-    ts, data = first_log[0]
-    first_log_yielded = False
-
-    while not complete:
-      try:
-        # yield the first log and continue
-        if not first_log_yielded:
-          first_log_yielded = True
-          complete = should_complete_stream(data, deployment)
-          yield log_formatter.deploy_log(data)
-          continue
-
-        # Get all logs since timestamp=ts
-        result = redis.xread(block=block, **{stream_key: ts})
-
-        if not result:
-          yield tci_keep_alive + '\n'
-          continue
-
-        items = result.get(stream_key)
-
-        if not items:
-          yield tci_keep_alive + '\n'
-          continue
-
-        for item in items:
-          ts, data = item
-          complete = should_complete_stream(data, deployment)
-          yield log_formatter.deploy_log(data)
-      except:
-        break
-  else:
-    ts = '0-0'
+def fail_deployment(deployment_uid):
+  """
+  Fail a deployment through a short-lived session.
 
-    while not complete:
-      try:
-        # Get all logs since timestamp=ts
-        result = redis.xread(block=block, **{stream_key: ts})
+  Streams can outlive the session their deployment was loaded in (the log stream server releases it
+  right away), so the deployment is re-queried here rather than updated through a detached instance.
+  """
+  try:
+    deployment = dbi.find_one(Deployment, {'uid': deployment_uid})
 
-        if not result:
-          yield tci_keep_alive + '\n'
-          continue
+    if deployment:
+      deployment.fail()
+  finally:
+    db.session.remove()
 
-        items = result.get(stream_key)
 
-        if not items:
-          yield tci_keep_alive + '\n'
-          continue
+def tail(stream_keys, block=30000, batch_size=BATCH_SIZE, after=None):
+  """
+  Tail one or more streams (history first, then new entries as they arrive), in batches.
 
-        for item in items:
-          ts, data = item
-          complete = should_complete_stream(data, deployment)
-          yield log_formatter.deploy_log(data)
-      except:
-        break
+  New entries come through this process' shared log hub rather than a dedicated XREAD. Entries of
+  different streams are merged in stream id order.
+
+  :param after: (optional) dict of stream_key --> entry id to resume after (history before it is skipped)
+
+  :return: generator of lists of (stream_key, entry_id, data) tuples. An empty list is yielded
+           whenever block ms pass without a new entry (so callers can send keep-alives).
+  """
+  after = after or {}
+
+  # Subscribe before reading history so nothing added in between is missed
+  sub = log_hub.subscribe(stream_keys)
 
+  try:
+    last_ids = {key: log_hub.parse_id(after[key]) for key in stream_keys if key in after}
 
-def stream_train_logs(deployment, block=30000):
-  stream_key = deployment.train_log()
-  first_log = redis.xrange(stream_key, count=1)
+    # Read every stream's (remaining) history in one round-trip
+    pipe = redis.pipeline()
 
-  # If logs already exist, yield the first one and then
-  # iterate over timestamps to continue yielding
-  if first_log:
-    ts, data = first_log[0]
-    first_log_yielded = False
+    for key in stream_keys:
+      pipe.execute_command('XRANGE', key, log_hub.next_id(after[key]) if key in after else '-', '+')
+
+    streams = dict(zip(stream_keys, pipe.execute()))
+
+    # Fall back to the archive for any streams that have expired from redis
+    archived = log_archive.read_archived([key for key in stream_keys if not streams[key]])
+
+    for key, entries in archived.items():
+      streams[key] = [(entry_id, data) for entry_id, data in entries
+                      if key not in last_ids or log_hub.parse_id(entry_id) > last_ids[key]]
+
+    history = []
+
+    for key, entries in streams.items():
+      if entries:
+        last_ids[key] = log_hub.parse_id(entries[-1][0])
+        history.extend((key, entry_id, data) for entry_id, data in entries)
+
+    history.sort(key=lambda entry: log_hub.parse_id(entry[1]))
+
+    for i in range(0, len(history), batch_size):
+      yield history[i:i + batch_size]
 
     while True:
-      try:
-        # yield the first log and continue
-        if not first_log_yielded:
-          first_log_yielded = True
-          yield log_formatter.training_log(data, with_color=True)
-          continue
-
-        # Get all logs since timestamp=ts
-        result = redis.xread(block=block, **{stream_key: ts})
-
-        if not result:
-          yield tci_keep_alive + '\n'
-          continue
-
-        items = result.get(stream_key)
-
-        if not items:
-          yield tci_keep_alive + '\n'
-          continue
-
-        for item in items:
-          ts, data = item
-          yield log_formatter.training_log(data, with_color=True)
-      except:
+      entries = sub.get(timeout=block / 1000.0, max_entries=batch_size)
+
+      dropped = sub.pop_dropped()
+
+      # The hub dropped entries this consumer was too slow for (possibly the one completing the stream), so
+      # read everything since the last entry yielded back from the streams themselves
+      if dropped:
+        logger.warn('Resyncing {} after the hub dropped {} entries for a slow log stream consumer.'.format(
+          stream_keys, dropped))
+
+        entries = entries + read_since(stream_keys, last_ids)
+
+      if not entries:
+        yield []
+        continue
+
+      # Skip anything already yielded (by id, so entries both resynced and still queued only go out once)
+      new_entries = {(key, entry_id): data for key, entry_id, data in entries
+                     if key not in last_ids or log_hub.parse_id(entry_id) > last_ids[key]}
+
+      batch = sorted(((key, entry_id, data) for (key, entry_id), data in new_entries.items()),
+                     key=lambda entry: log_hub.parse_id(entry[1]))
+
+      # Batches are in id order, so each stream's last entry yielded ends up last
+      for key, entry_id, data in batch:
+        last_ids[key] = log_hub.parse_id(entry_id)
+
+      for i in range(0, len(batch), batch_size):
+        record_latency(batch[i:i + batch_size])
+        yield batch[i:i + batch_size]
+  finally:
+    sub.close()
+
+
+def read_since(stream_keys, last_ids):
+  """
+  Read the entries of each stream after the given ids (all of a stream's entries if it has none).
+
+  :return: list of (stream_key, entry_id, data) tuples
+  """
+  pipe = redis.pipeline()
+
+  for key in stream_keys:
+    start = log_hub.next_id('{}-{}'.format(*last_ids[key])) if key in last_ids else '-'
+    pipe.execute_command('XRANGE', key, start, '+')
+
+  return [(key, entry_id, data) for key, entries in zip(stream_keys, pipe.execute()) for entry_id, data in entries]
+
+
+def record_latency(batch):
+  """
+  Record how long the entries of a live batch took to reach their tail (since being added to their stream).
+  """
+  now = ms_since_epoch()
+
+  with latency_lock:
+    for key, entry_id, data in batch:
+      window = latency_windows.pop(key, None) or deque(maxlen=LATENCY_WINDOW)
+      window.append(max(now - log_hub.parse_id(entry_id)[0], 0))
+      latency_windows[key] = window
+
+    while len(latency_windows) > MAX_LATENCY_STREAMS:
+      latency_windows.popitem(last=False)
+
+  # Newest entry of the batch is the best measure of how far behind the tail is
+  latency = max(now - log_hub.parse_id(batch[-1][1])[0], 0)
+
+  if latency > SLOW_TAIL_LATENCY:
+    logger.warn('Log stream tail of {} is {}ms behind.'.format(batch[-1][0], int(latency)))
+
+
+def tail_metrics():
+  """
+  Get a snapshot of this process' current log stream tail latencies, by stream, over each one's most recent entries.
+  """
+  with latency_lock:
+    return {
+      key: {
+        'entries': len(window),
+        'avg_ms': int(sum(window) / len(window)),
+        'max_ms': int(max(window)),
+        'last_ms': int(window[-1])
+      } for key, window in latency_windows.items()
+    }
+
+
+def format_resume_token(positions):
+  """
+  Encode the last entry id sent from each stream as a resume token ('<stream_key>=<entry_id>;...').
+  """
+  return ';'.join('{}={}'.format(key, entry_id) for key, entry_id in sorted(positions.items()))
+
+
+def parse_resume_token(token, stream_keys):
+  """
+  Decode a resume token into a dict of stream_key --> entry id to resume after (ignoring other streams).
+  """
+  positions = {}
+
+  for part in (token or '').split(';'):
+    key, _, entry_id = part.strip().rpartition('=')
+
+    if key not in stream_keys:
+      continue
+
+    try:
+      log_hub.parse_id(entry_id)
+    except ValueError:
+      continue
+
+    positions[key] = entry_id
+
+  return positions
+
+
+def stream_logs(stream_keys, format_entry, complete_on=None, block=30000, resume_token=None,
+                with_resume_tokens=False):
+  """
+  Stream formatted log lines for one or more streams, flushing each batch of entries as a single chunk.
+
+  :param stream_keys:        (required) redis stream keys to tail
+  :param format_entry:       (required) function(stream_key, data) --> formatted log line
+  :param complete_on:        (optional) function(stream_key, data) --> whether the stream is complete after this entry
+  :param block:              (optional) ms to wait for new entries before sending a keep-alive
+  :param resume_token:       (optional) resume token (or Last-Event-ID) of a previous stream to pick up where it left off
+  :param with_resume_tokens: (optional) whether to follow each chunk with a resume token line for reconnecting
+  """
+  positions = parse_resume_token(resume_token, stream_keys)
+
+  try:
+    for batch in tail(stream_keys, block=block, after=dict(positions)):
+      if not batch:
+        yield tci_keep_alive + '\n'
+        continue
+
+      lines = []
+      complete = False
+
+      for key, entry_id, data in batch:
+        lines.append(format_entry(key, data))
+        positions[key] = entry_id
+
+        if complete_on and complete_on(key, data):
+          complete = True
+          break
+
+      if with_resume_tokens:
+        lines.append(tci_resume_token + format_resume_token(positions) + '\n')
+
+      yield ''.join(lines)
+
+      if complete:
         break
-  else:
-    ts = '0-0'
+  except Exception as e:
+    # Don't let a failed stream just silently end for the client
+    logger.error('Log stream of {} failed: {}'.format(stream_keys, e))
+    raise
+
+
+def stream_deploy_logs(deployment, stream_key=None, block=30000, **kwargs):
+  deployment_uid = deployment.uid
+
+  return stream_logs([stream_key],
+                     lambda key, data: log_formatter.deploy_log(data),
+                     complete_on=lambda key, data: should_complete_stream(data, deployment_uid),
+                     block=block,
+                     **kwargs)
+
+
+def stream_train_logs(deployment, block=30000, **kwargs):
+  return stream_logs([deployment.train_log()],
+                     lambda key, data: log_formatter.training_log(data, with_color=True),
+                     block=block,
+                     **kwargs)
+
+
+def stream_deployment_logs(deployment, block=30000, **kwargs):
+  """
+  Stream a deployment's full lifecycle (train deploy, training and API deploy logs) through one connection.
+  """
+  deployment_uid = deployment.uid
+  train_log = deployment.train_log()
+  done_training_log = deployment.done_training_log()
+  final_log = deployment.api_deploy_log() if deployment.intent_to_serve() else done_training_log
+
+  def format_entry(key, data):
+    if key == train_log:
+      return log_formatter.training_log(data, with_color=True)
+
+    return log_formatter.deploy_log(data)
+
+  def complete_on(key, data):
+    if key == train_log:
+      return False
+
+    # Any deploy error ends (and fails) the deployment
+    if data.get('level') == 'error':
+      return should_complete_stream(data, deployment_uid)
+
+    # Training is only the last stage of train-only deployments
+    if key == done_training_log:
+      return final_log == done_training_log
+
+    # The train deploy's last entry only marks the hand-off to training
+    return key == final_log and data.get('last_entry') == 'True'
+
+  keys = [deployment.train_deploy_log(), train_log, done_training_log, deployment.api_deploy_log()]
+
+  return stream_logs(keys, format_entry, complete_on=complete_on, block=block, **kwargs)
+
+
+def open_stream(deployment, kind, stream_key=None, block=30000, resume_token=None, with_resume_tokens=False):
+  """
+  Get the generator streaming a deployment's logs of the given kind.
+  """
+  kwargs = {'block': block, 'resume_token': resume_token, 'with_resume_tokens': with_resume_tokens}
+
+  if kind == DEPLOY_LOGS:
+    return stream_deploy_logs(deployment, stream_key=stream_key, **kwargs)
+
+  if kind == TRAIN_LOGS:
+    return stream_train_logs(deployment, **kwargs)
+
+  if kind == ALL_LOGS:
+    return stream_deployment_logs(deployment, **kwargs)
+
+  raise BaseException('Unknown log stream kind: {}'.format(kind))
+
+
+def handoff_token_key(token):
+  return 'log-stream-token:{}'.format(token)
+
+
+def issue_handoff_token(deployment, kind, stream_key=None, resume_token=None, with_resume_tokens=False):
+  """
+  Issue a short-lived, single-use token the log stream server can redeem to open this log stream.
+  """
+  token = uuid4().hex
+
+  redis.setex(handoff_token_key(token), HANDOFF_TOKEN_TTL, json.dumps({
+    'deployment_uid': deployment.uid,
+    'kind': kind,
+    'stream_key': stream_key,
+    'resume_token': resume_token,
+    'with_resume_tokens': with_resume_tokens
+  }))
+
+  return token
 
-    while True:
-      try:
-        # Get all logs since timestamp=ts
-        result = redis.xread(block=block, **{stream_key: ts})
 
-        if not result:
-          yield tci_keep_alive + '\n'
-          continue
+def redeem_handoff_token(token):
+  """
+  Redeem a log stream handoff token (deleting it so it can't be reused).
 
-        items = result.get(stream_key)
+  :return: dict with the log stream's deployment_uid, kind, stream_key and resume options -- or None if the
+           token is invalid or expired
+  """
+  pipe = redis.pipeline()
+  pipe.get(handoff_token_key(token))
+  pipe.delete(handoff_token_key(token))
+  handoff, _ = pipe.execute()
 
-        if not items:
-          yield tci_keep_alive + '\n'
-          continue
+  if not handoff:
+    return None
 
-        for item in items:
-          ts, data = item
-          yield log_formatter.training_log(data, with_color=True)
-      except:
-        break
\ No newline at end of file
+  return json.loads(handoff)
@@ -1,8 +1,33 @@
 import json
+from functools import wraps
+from contextlib import contextmanager
+from threading import Lock, Timer, local
+import update_streams
 from pyredis import redis
 from src.helpers import ms_since_epoch
 from src.helpers.definitions import deploy_update_queue
 
+# Max number of buffered redis log writes before they're flushed
+BUFFER_SIZE = 50
+
+# Max time (s) a buffered redis log write waits before being flushed
+FLUSH_INTERVAL = 0.5
+
+# Approximate max number of entries kept per log stream, by stream type (key prefix)
+STREAM_MAXLENS = {
+  'train-deploy': 10000,
+  'api-deploy': 10000,
+  'train': 100000,
+  'done-training': 100,
+  deploy_update_queue: update_streams.STREAM_MAXLEN
+}
+
+DEFAULT_STREAM_MAXLEN = 10000
+
+
+# Per-thread log buffer (set while buffering)
+state = local()
+
 
 class Logger(object):
 
@@ -29,11 +54,8 @@ class Logger(object):
     if kwargs.get('stream'):
       stream = kwargs.pop('stream')
 
-      redis.xadd(stream,
-                 text=text,
-                 level=level,
-                 ts=ms_since_epoch(),
-                 **kwargs)
+      fields = dict(text=text, level=level, ts=ms_since_epoch(), **kwargs)
+      writes = [(stream, fields)]
 
       stream_key_comps = stream.split(':')
       deployment_uid = None
@@ -44,4 +66,125 @@ class Logger(object):
 
       if deployment_uid and stage:
         payload = {'deployment_uid': deployment_uid, 'stage': stage}
-        redis.rpush(deploy_update_queue, json.dumps(payload))
+        writes.append((update_streams.shard_stream(deploy_update_queue, deployment_uid),
+                       {update_streams.DATA_FIELD: json.dumps(payload)}))
+
+      # Stream readers act on last entries and errors right away, so never hold those back
+      flush = level == 'error' or kwargs.get('last_entry') in (True, 'True')
+
+      write(writes, flush=flush)
+
+
+class LogBuffer(object):
+  """
+  Buffer of redis log writes, flushed (in order) through a single pipeline once it's full,
+  once its oldest write has waited flush_interval seconds, or when explicitly flushed.
+  """
+
+  def __init__(self, max_size=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL):
+    self.max_size = max_size
+    self.flush_interval = flush_interval
+    self.writes = []
+    self.lock = Lock()
+    self.timer = None
+
+  def add(self, writes, flush=False):
+    with self.lock:
+      self.writes.extend(writes)
+
+      if flush or len(self.writes) >= self.max_size:
+        self.flush_writes()
+      elif not self.timer:
+        self.timer = Timer(self.flush_interval, self.on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+  def flush(self):
+    with self.lock:
+      self.flush_writes()
+
+  def flush_writes(self):
+    # Must be called with the lock held, so flushes can't overtake each other
+    if self.timer:
+      self.timer.cancel()
+      self.timer = None
+
+    if not self.writes:
+      return
+
+    writes, self.writes = self.writes, []
+
+    execute(writes)
+
+  def on_timer(self):
+    try:
+      self.flush()
+    except BaseException as e:
+      print('Error flushing buffered logs: {}'.format(e))
+
+
+def execute(writes):
+  """
+  Perform redis log writes (stream_key, fields) -- in order, in one round-trip.
+  """
+  pipe = redis.pipeline(transaction=False)
+
+  for key, fields in writes:
+    # Trim the stream as we go ('~' lets redis trim lazily, in whole nodes, which is much cheaper)
+    args = ['XADD', key, 'MAXLEN', '~', stream_maxlen(key), '*']
+
+    for field, value in fields.items():
+      args.extend([field, value])
+
+    pipe.execute_command(*args)
+
+  pipe.execute()
+
+
+def stream_maxlen(stream_key):
+  return STREAM_MAXLENS.get(stream_key.split(':')[0], DEFAULT_STREAM_MAXLEN)
+
+
+def write(writes, flush=False):
+  buffer = getattr(state, 'buffer', None)
+
+  if buffer:
+    buffer.add(writes, flush=flush)
+  else:
+    execute(writes)
+
+
+@contextmanager
+def buffering(max_size=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL):
+  """
+  Buffer this thread's redis log writes for the duration of the block, flushing whatever's left on exit.
+
+  Usage:
+
+    with buffering():
+      logger.info('Building...', stream=log_stream_key, stage=stage)
+  """
+  # Already buffering further up the stack
+  if getattr(state, 'buffer', None):
+    yield
+    return
+
+  state.buffer = LogBuffer(max_size=max_size, flush_interval=flush_interval)
+
+  try:
+    yield
+  finally:
+    buffer, state.buffer = state.buffer, None
+    buffer.flush()
+
+
+def buffered(func):
+  """
+  Decorator buffering the redis log writes made while func runs (e.g. chatty deploy jobs).
+  """
+  @wraps(func)
+  def wrapper(*args, **kwargs):
+    with buffering():
+      return func(*args, **kwargs)
+
+  return wrapper
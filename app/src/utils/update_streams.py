@@ -0,0 +1,271 @@
+"""
+Sharded redis stream work queues for the watchers.
+
+Each update queue (e.g. deploy-update-queue) is split into NUM_SHARDS streams ('<queue>:<shard>'), with
+an update's shard picked from its shard key (e.g. deployment_uid), so every update for the same thing
+lands on the same shard, in order.
+
+Watchers read their shards through a consumer group. With WATCHER_SHARD_COUNT watcher processes, the one
+with WATCHER_SHARD_INDEX=i owns every shard s where s % WATCHER_SHARD_COUNT == i, so adding replicas
+splits the shards (and the load) between them. Entries left pending by a crashed consumer are reclaimed
+(XCLAIM) by the shard's next owner.
+
+Consumers are named after their shard slot (not their host/pid), so a restarted watcher picks up where
+its predecessor left off instead of adding another consumer to the group. Consumers left idle with
+nothing pending (e.g. after WATCHER_SHARD_COUNT changes) are deleted from the group.
+
+Some producers (training jobs, the build server) still RPUSH updates onto the old list queues, so the
+watcher owning shard 0 also forwards those into the streams.
+
+Requires Redis >= 5.0.
+"""
+import os
+import json
+import zlib
+from time import time, sleep
+from redis.exceptions import ResponseError
+from pyredis import redis
+
+# Number of streams each update queue is split into (must be the same for every producer and watcher)
+NUM_SHARDS = int(os.environ.get('UPDATE_STREAM_SHARDS', 16))
+
+# Consumer group every watcher reads through
+GROUP = 'watchers'
+
+# Approximate max number of entries kept per shard
+STREAM_MAXLEN = 100000
+
+# Max number of entries read per shard at a time
+READ_COUNT = 500
+
+# How long (ms) an entry can sit unacknowledged before another consumer may claim it
+RECLAIM_IDLE = 60000
+
+# How often (s) to check for pending entries to reclaim
+RECLAIM_INTERVAL = 30
+
+# Entries delivered this many times are assumed to crash their consumer and are dropped
+MAX_DELIVERIES = 5
+
+# Stream entry field holding the (JSON) update
+DATA_FIELD = 'data'
+
+
+def shard(shard_key):
+  return (zlib.crc32(str(shard_key)) & 0xffffffff) % NUM_SHARDS
+
+
+def shard_stream(queue, shard_key):
+  return '{}:{}'.format(queue, shard(shard_key))
+
+
+def fields_to_dict(fields):
+  if isinstance(fields, dict):
+    return fields
+
+  return dict(zip(fields[0::2], fields[1::2]))
+
+
+def parse_entries(stream, entries):
+  """
+  Parse stream entries into (stream, entry_id, update) tuples. update is None for entries that no longer exist.
+  """
+  parsed = []
+
+  for entry_id, fields in entries or []:
+    data = fields_to_dict(fields or {}).get(DATA_FIELD)
+    parsed.append((stream, entry_id, json.loads(data) if data else None))
+
+  return parsed
+
+
+def xadd_command(queue, shard_key, update):
+  """
+  Get the XADD command args enqueueing an update (so it can be sent on its own or through a pipeline).
+  """
+  return ['XADD', shard_stream(queue, shard_key), 'MAXLEN', '~', STREAM_MAXLEN, '*', DATA_FIELD, json.dumps(update)]
+
+
+class ShardConsumer(object):
+  """
+  Reads a watcher's shards of an update queue through the watchers' consumer group.
+
+  Usage:
+
+    consumer = ShardConsumer(deploy_update_queue, shard_key_field='deployment_uid')
+
+    while True:
+      entries = consumer.read()
+      ...
+      consumer.ack(entries)
+
+  """
+
+  def __init__(self, queue, shard_key_field=None, index=None, count=None):
+    self.queue = queue
+    self.shard_key_field = shard_key_field
+    self.index = int(index if index is not None else os.environ.get('WATCHER_SHARD_INDEX', 0))
+    self.count = int(count if count is not None else os.environ.get('WATCHER_SHARD_COUNT', 1))
+    self.consumer = 'shard-{}-of-{}'.format(self.index, self.count)
+    self.last_reclaim = 0
+
+    self.streams = ['{}:{}'.format(queue, s) for s in range(NUM_SHARDS) if s % self.count == self.index]
+
+    if not self.streams:
+      raise BaseException('Watcher shard {} of {} owns none of the {} shards'.format(self.index, self.count, NUM_SHARDS))
+
+    self.ensure_groups()
+
+  def owns_legacy_queue(self):
+    # Exactly one watcher forwards the legacy list, so forwarded updates keep their order
+    return self.index == 0
+
+  def ensure_groups(self):
+    for stream in self.streams:
+      try:
+        redis.execute_command('XGROUP', 'CREATE', stream, GROUP, '0', 'MKSTREAM')
+      except ResponseError as e:
+        # Group already exists
+        if 'BUSYGROUP' not in str(e):
+          raise
+
+  def read(self, block=None):
+    """
+    Read new entries from this consumer's shards (reclaiming any stuck pending entries first, every so often).
+
+    :param block: (optional) ms to block for if nothing's available (doesn't block if None)
+
+    :return: list of (stream, entry_id, update) tuples
+    """
+    if time() - self.last_reclaim > RECLAIM_INTERVAL:
+      self.last_reclaim = time()
+      reclaimed = self.reclaim()
+
+      if reclaimed:
+        return reclaimed
+
+    args = ['XREADGROUP', 'GROUP', GROUP, self.consumer, 'COUNT', READ_COUNT]
+
+    if block is not None:
+      args.extend(['BLOCK', block])
+
+    args.append('STREAMS')
+    args.extend(self.streams)
+    args.extend(['>'] * len(self.streams))
+
+    response = redis.execute_command(*args)
+
+    if not response:
+      return []
+
+    if isinstance(response, dict):
+      response = response.items()
+
+    entries = []
+
+    for stream, stream_entries in response:
+      entries.extend(parse_entries(stream, stream_entries))
+
+    return entries
+
+  def ack(self, entries):
+    ids_by_stream = {}
+
+    for stream, entry_id, update in entries:
+      ids_by_stream.setdefault(stream, []).append(entry_id)
+
+    if not ids_by_stream:
+      return
+
+    pipe = redis.pipeline(transaction=False)
+
+    for stream, entry_ids in ids_by_stream.items():
+      pipe.execute_command('XACK', stream, GROUP, *entry_ids)
+
+    pipe.execute()
+
+  def reclaim(self):
+    """
+    Claim the entries of this consumer's shards left pending (unacknowledged) for too long -- by other consumers,
+    by this consumer's previous incarnation, or by this process after failing to handle them -- then delete
+    consumers that are idle with nothing left pending.
+
+    :return: list of (stream, entry_id, update) tuples claimed
+    """
+    claimed = []
+
+    for stream in self.streams:
+      pending = redis.execute_command('XPENDING', stream, GROUP, '-', '+', READ_COUNT) or []
+
+      stale_ids = []
+      dropped = []
+
+      for entry_id, consumer, idle, deliveries in pending:
+        if idle < RECLAIM_IDLE:
+          continue
+
+        if deliveries >= MAX_DELIVERIES:
+          dropped.append((stream, entry_id, None))
+        else:
+          stale_ids.append(entry_id)
+
+      if dropped:
+        print('Dropping {} updates from {} after {} failed deliveries.'.format(len(dropped), stream, MAX_DELIVERIES))
+        self.ack(dropped)
+
+      if stale_ids:
+        entries = redis.execute_command('XCLAIM', stream, GROUP, self.consumer, RECLAIM_IDLE, *stale_ids)
+        claimed.extend(parse_entries(stream, entries))
+
+      self.delete_dead_consumers(stream)
+
+    return claimed
+
+  def delete_dead_consumers(self, stream):
+    for consumer in redis.execute_command('XINFO', 'CONSUMERS', stream, GROUP) or []:
+      info = fields_to_dict(consumer)
+
+      if info.get('name') == self.consumer or int(info.get('pending', 0)) or int(info.get('idle', 0)) < RECLAIM_IDLE:
+        continue
+
+      redis.execute_command('XGROUP', 'DELCONSUMER', stream, GROUP, info['name'])
+
+  def forward_legacy_queue(self, timeout=30, max_items=READ_COUNT):
+    """
+    Move updates RPUSH-ed onto the queue's legacy list into their shard streams (blocks up to timeout s for one).
+    """
+    item = redis.blpop(self.queue, timeout=timeout)
+
+    if not item:
+      return 0
+
+    # Take whatever else is queued up along with it in one round-trip
+    pipe = redis.pipeline()
+    pipe.lrange(self.queue, 0, max_items - 1)
+    pipe.ltrim(self.queue, max_items, -1)
+    items = [item[1]] + pipe.execute()[0]
+
+    pipe = redis.pipeline(transaction=False)
+
+    for raw_item in items:
+      try:
+        update = json.loads(raw_item) or {}
+      except ValueError:
+        continue
+
+      if not isinstance(update, dict) or not update.get(self.shard_key_field):
+        continue
+
+      pipe.execute_command(*xadd_command(self.queue, update[self.shard_key_field], update))
+
+    pipe.execute()
+
+    return len(items)
+
+  def forward_legacy_queue_forever(self):
+    while True:
+      try:
+        self.forward_legacy_queue()
+      except BaseException as e:
+        print('Error forwarding {} updates: {}'.format(self.queue, e))
+        sleep(1)